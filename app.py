@@ -1,8 +1,11 @@
 
 import argparse
-from viewer import Viewer
-from editor import Editor
-from typing import Optional
+import json
+from typing import Optional, TYPE_CHECKING
+from profiler import profiler
+
+if TYPE_CHECKING:
+    from viewer import Viewer
 
 description="""NFT manual generator
 
@@ -13,24 +16,38 @@ parser.add_argument('--svg-width', help='Default svg width when convert to png,
 parser.add_argument('--svg-height', help='Default svg height when convert to png, if svg used as background layer', default=1080, type=int)
 parser.add_argument('--blueprint', help='JSON template for generating output json file', default='blueprint.json')
 parser.add_argument('--viewer', help='Starts in viewer mode', nargs='?', const=-1, default=None)
+parser.add_argument('--layer-cache-mb', help='Memory budget in MB for decoded layers and intermediate composites in editor', default=512, type=int)
+parser.add_argument('--no-layer-store', help='Generator workers decode layers themselves instead of sharing memory-mapped store', action='store_true')
+parser.add_argument('--prefetch-window', help='Items before and after current one prepared in background by viewer', default=2, type=int)
+parser.add_argument('--prefetch-cache-mb', help='Memory budget in MB for prepared items in viewer', default=256, type=int)
 parser.add_argument('--nft-name-prefix', help='Prefix for NFT name in result json', default='NFT #')
-args = parser.parse_args()
+parser.add_argument('--generate', help='Generate N items with weighted random traits without GUI', type=int, metavar='N')
+parser.add_argument('--generate-all', help='Render every valid combination not saved yet without GUI (for small collections)', action='store_true')
+parser.add_argument('--seed', help='Random seed for --generate', default=None, type=int)
+parser.add_argument('--workers', help='Worker processes for --generate (default: cpu count)', default=None, type=int)
+parser.add_argument('--variants', help='JSON file with list of extra sizes written with every item: name, size, format, params, palette (default: 512px preview and 128px thumb)', default=None)
+parser.add_argument('--shared-palette', help='Map .min.png and palette variants to one 255-color palette of all layer files instead of own palette of every item (better colors, usually larger files)', action='store_true')
+parser.add_argument('--profile', help='Time hot stages (decode, svg render, composite, widgets rebuild, Tk image conversion), with cprofile also run cProfile; dumped on exit', nargs='?', const='timers', choices=['timers', 'cprofile'], default=None)
+parser.add_argument('--profile-output', help='Prefix of profile files: PREFIX.json (percentiles and Chrome trace events), PREFIX.prof (cProfile)', default='profile')
 
 class App:
     blueprint_template: dict
     traits: list
-    viewer_instance: Optional[Viewer]
+    viewer_instance: Optional['Viewer']
 
     def __init__(self, args) -> None:
         self.args = args
        
     def show_editor(self):
+        from editor import Editor
         self.editor = Editor(args=self.args)
         self.editor.show_viewer_button.configure(command=self.show_viewer)
         self.editor.mainloop()
 
     def show_viewer(self):
-        self.viewer_instance = Viewer()
+        from viewer import Viewer
+        rarity = self.editor.rarity if hasattr(self, 'editor') else None
+        self.viewer_instance = Viewer(prefetch_window=self.args.prefetch_window, prefetch_cache_mb=self.args.prefetch_cache_mb, rarity=rarity)
         self.viewer_instance.protocol("WM_DELETE_WINDOW", self.close_viewer)
         self.viewer_instance.show_item_by_name(-1)
         return self.viewer_instance
@@ -39,10 +56,35 @@ class App:
         self.viewer_instance.destroy()
         self.viewer_instance = None
 
-app = App(args)
-if args.viewer:
-    viewer = app.show_viewer()
-    viewer.show_item_by_name(args.viewer)
-    viewer.mainloop()
-else:
-    app.show_editor()
\ No newline at end of file
+def generate(args):
+    import traits
+    import generator
+    import output
+    with open(args.blueprint) as json_file:
+        blueprint = json.load(json_file)
+    groups = traits.load('traits.json')
+    if args.generate_all:
+        generator.generate_all(groups, blueprint, args.nft_name_prefix, workers=args.workers,
+                               svg_width=args.svg_width, svg_height=args.svg_height, cache_mb=args.layer_cache_mb, variants=output.load_variants(args.variants), layer_store=not args.no_layer_store, shared_palette=args.shared_palette)
+    else:
+        generator.generate(groups, args.generate, blueprint, args.nft_name_prefix, seed=args.seed, workers=args.workers,
+                           svg_width=args.svg_width, svg_height=args.svg_height, cache_mb=args.layer_cache_mb, variants=output.load_variants(args.variants), layer_store=not args.no_layer_store, shared_palette=args.shared_palette)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable(cprofile=args.profile == 'cprofile')
+    try:
+        if args.generate or args.generate_all:
+            generate(args)
+        else:
+            app = App(args)
+            if args.viewer:
+                viewer = app.show_viewer()
+                viewer.show_item_by_name(args.viewer)
+                viewer.mainloop()
+            else:
+                app.show_editor()
+    finally:
+        if args.profile:
+            print('Profile written to %s' % ', '.join(profiler.dump(args.profile_output)))
@@ -0,0 +1,265 @@
+import os
+import sys
+import argparse
+import json
+import time
+import random
+import tempfile
+import platform
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+import compositor
+
+
+def random_layers(count, width, height, seed=0) -> list:
+    """
+    Return list of uint8 RGBA layers like trait files: opaque background
+    and layers with random colors in rectangle with soft edge, transparent elsewhere
+    """
+    rng = np.random.default_rng(seed)
+    layers = []
+    for i in range(count):
+        layer = rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+        if i > 0:
+            alpha = np.zeros((height, width), dtype=np.uint8)
+            x0, x1 = sorted(rng.integers(0, width, size=2))
+            y0, y1 = sorted(rng.integers(0, height, size=2))
+            alpha[y0:y1, x0:x1] = 255
+            edge = max(1, min(x1 - x0, y1 - y0) // 10)
+            band = alpha[y0:y1, x0:x0 + edge]
+            band[...] = rng.integers(1, 255, size=band.shape, dtype=np.uint8)
+            layer[..., 3] = alpha
+        else:
+            layer[..., 3] = 255
+        layers.append(layer)
+    return layers
+
+
+def pillow_composite(layers: list) -> np.ndarray:
+    """Previous Editor.combine_image path: new frame, paste and alpha_composite per layer"""
+    result = None
+    for layer in layers:
+        img = Image.fromarray(layer, 'RGBA')
+        if result == None:
+            result = img
+        else:
+            aimg = Image.new('RGBA', result.size)
+            aimg.paste(img, (0,0))
+            result = Image.alpha_composite(result, aimg)
+    return np.asarray(result)
+
+
+def timeit(func, repeat) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None or elapsed < best else best
+    return best
+
+
+def bench_compositor(count=15, width=1080, height=1080, repeat=3) -> dict:
+    """
+    Time compositor on cropped layers (as LayerCache keeps them) against previous
+    Pillow path, full stack and change of top layer over cached composite of the rest
+    """
+    layers = random_layers(count, width, height)
+    cropped = [compositor.crop(layer) for layer in layers]
+    expected = pillow_composite(layers)
+    result = np.asarray(compositor.composite(cropped))
+    diff = np.abs(expected.astype(np.int16) - result.astype(np.int16))
+    prefix = Image.fromarray(pillow_composite(layers[:-1]), 'RGBA')
+    small = np.zeros((height, width, 4), dtype=np.uint8)
+    small[height // 2:height // 2 + height // 8, width // 2:width // 2 + width // 8] = layers[-1][:height // 8, :width // 8]
+    return {
+        'layers': count,
+        'width': width,
+        'height': height,
+        'pillow_seconds': timeit(lambda: pillow_composite(layers), repeat),
+        'compositor_seconds': timeit(lambda: compositor.composite(cropped), repeat),
+        'top_layer_change': {
+            'pillow_seconds': timeit(lambda: pillow_composite([np.asarray(prefix), layers[-1]]), repeat),
+            'compositor_seconds': timeit(lambda: compositor.composite([prefix, cropped[-1]]), repeat),
+        },
+        'small_layer_change': {
+            'pillow_seconds': timeit(lambda: pillow_composite([np.asarray(prefix), small]), repeat),
+            'compositor_seconds': timeit(lambda: compositor.composite([prefix, compositor.crop(small)]), repeat),
+        },
+        'max_diff': int(diff.max()),
+    }
+
+
+def synthetic_layer(file, width, height, rng: random.Random, background=False):
+    """Write png or svg layer: opaque background or few shapes on transparent canvas"""
+    color = lambda: (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    shapes = []
+    for _ in range(rng.randint(1, 4)):
+        x0, x1 = sorted(rng.randrange(width) for _ in range(2))
+        y0, y1 = sorted(rng.randrange(height) for _ in range(2))
+        shapes.append((rng.choice(['rect', 'ellipse']), x0, y0, x1 + 1, y1 + 1, color(), rng.randint(128, 255)))
+    if file.endswith('.svg'):
+        elements = ['<rect width="%d" height="%d" fill="rgb%s"/>' % (width, height, str(color()))] if background else []
+        for kind, x0, y0, x1, y1, fill, alpha in shapes:
+            if kind == 'rect':
+                elements.append('<rect x="%d" y="%d" width="%d" height="%d" fill="rgb%s" fill-opacity="%.2f"/>' % (x0, y0, x1 - x0, y1 - y0, str(fill), alpha / 255))
+            else:
+                elements.append('<ellipse cx="%.1f" cy="%.1f" rx="%.1f" ry="%.1f" fill="rgb%s" fill-opacity="%.2f"/>' % ((x0 + x1) / 2, (y0 + y1) / 2, (x1 - x0) / 2, (y1 - y0) / 2, str(fill), alpha / 255))
+        with open(file, 'w') as f:
+            f.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">%s</svg>' % (width, height, ''.join(elements)))
+        return
+    img = Image.new('RGBA', (width, height), color() + (255,) if background else (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for kind, x0, y0, x1, y1, fill, alpha in shapes:
+        getattr(draw, 'rectangle' if kind == 'rect' else 'ellipse')((x0, y0, x1, y1), fill=fill + (alpha,))
+    img.save(file)
+
+
+def synthetic_collection(path, groups=10, traits_per_group=10, constraint_density=0.1, width=1080, height=1080, svg_share=0.2, seed=0) -> str:
+    """
+    Write traits.json and layer files of random collection into path, return traits file
+
+    First group is opaque background. With probability constraint_density every trait
+    excludes a trait of another group and gets a variant adapted to another trait.
+    svg_share of layer files are svg (rendered with width and height).
+    """
+    rng = random.Random(seed)
+    input_path = os.path.join(path, 'input')
+    os.makedirs(input_path, exist_ok=True)
+    titles = [['G%d T%d' % (g, t) for t in range(traits_per_group)] for g in range(groups)]
+    collection = {}
+    for g in range(groups):
+        group = {}
+        for t, title in enumerate(titles[g]):
+            ext = 'svg' if rng.random() < svg_share else 'png'
+            file = os.path.join(input_path, 'g%d-t%d.%s' % (g, t, ext))
+            synthetic_layer(file, width, height, rng, background=g == 0)
+            trait = {'weight': rng.randint(1, 10), 'file': file}
+            if groups > 1 and rng.random() < constraint_density:
+                other = rng.choice([i for i in range(groups) if i != g])
+                trait['exclude'] = [rng.choice(titles[other])]
+            if groups > 1 and rng.random() < constraint_density:
+                other = rng.choice([i for i in range(groups) if i != g])
+                variant = os.path.join(input_path, 'g%d-t%d-adapted.%s' % (g, t, ext))
+                synthetic_layer(variant, width, height, rng, background=g == 0)
+                trait['file'] = [file, {'path': variant, 'adapted-to': [rng.choice(titles[other])]}]
+            group[title] = trait
+        collection['group %d' % g] = group
+    traits_file = os.path.join(path, 'traits.json')
+    with open(traits_file, 'w') as f:
+        json.dump(collection, f, indent=4)
+    return traits_file
+
+
+def bench_suite(path, groups=10, traits_per_group=10, constraint_density=0.1, width=1080, height=1080, svg_share=0.2, repeat=3, seed=0) -> dict:
+    """
+    Time loading, healthcheck, editor compositing and save path on synthetic collection in path
+
+    Compositing is timed as in Editor.combine_image: cold (layers decoded and svg rendered),
+    warm full stack (layers cached) and change of top group (prefix of lower groups cached).
+    """
+    import traits
+    import healthcheck
+    import layers
+    import output
+    import palette
+    from svgcache import SvgCache
+
+    start = time.perf_counter()
+    traits_file = synthetic_collection(path, groups, traits_per_group, constraint_density, width, height, svg_share, seed)
+    results = {'generate_collection_seconds': time.perf_counter() - start}
+
+    snapshot_path = os.path.join(path, 'cache')
+    results['traits_load_seconds'] = timeit(lambda: traits.load(traits_file, verbose=False, snapshot_path=None), repeat)
+    collection = traits.load(traits_file, verbose=False, snapshot_path=snapshot_path)
+    results['traits_load_snapshot_seconds'] = timeit(lambda: traits.load(traits_file, verbose=False, snapshot_path=snapshot_path), repeat)
+    names = healthcheck.name_index(collection)
+    results['healthcheck_seconds'] = {
+        'name_index': timeit(lambda: healthcheck.name_index(collection), repeat),
+        'same_trait_name': timeit(lambda: healthcheck.same_trait_name(collection, names, False), repeat),
+        'adapted_for_unknown': timeit(lambda: healthcheck.adapted_for_unknown(collection, names, False), repeat),
+        'excluded_for_unknown': timeit(lambda: healthcheck.excluded_for_unknown(collection, names, False), repeat),
+        'run': timeit(lambda: healthcheck.run(collection, False), repeat),
+    }
+
+    layers.svg_cache = SvgCache(os.path.join(path, 'cache', 'svg'))
+    files = [file for group in collection for file in group['current']['file']]
+    cache = layers.LayerCache(budget_mb=4096)
+    start = time.perf_counter()
+    stack = [cache.get(file, width, height) for file in files]
+    results['layers_decode_cold_seconds'] = time.perf_counter() - start
+    cache.clear()
+    start = time.perf_counter()
+    stack = [cache.get(file, width, height) for file in files]
+    results['layers_decode_svg_cached_seconds'] = time.perf_counter() - start
+    top = collection[-1]['current']['file']
+    prefix = compositor.composite(stack[:len(stack) - len(top)])
+    results['composite_seconds'] = {
+        'layers': len(stack),
+        'full_stack': timeit(lambda: compositor.composite(stack), repeat),
+        'top_group_change': timeit(lambda: compositor.composite([prefix] + stack[len(stack) - len(top):]), repeat),
+    }
+
+    img = compositor.composite(stack)
+    out_path = os.path.join(path, 'out')
+    os.makedirs(out_path, exist_ok=True)
+    # write_item writes own .min.png, kept apart from the compared ones
+    item_path = os.path.join(path, 'item')
+    os.makedirs(item_path, exist_ok=True)
+    start = time.perf_counter()
+    shared_palette = palette.load(collection, width, height, snapshot_path)
+    results['palette_build_seconds'] = time.perf_counter() - start
+    attributes = [{'trait_type': group['group'], 'value': group['current']['title']} for group in collection]
+    results['save_seconds'] = {
+        'png': timeit(lambda: output.save_atomic(img, os.path.join(out_path, 'bench.png')), repeat),
+        'min_png': timeit(lambda: output.save_atomic(shared_palette.quantize(img), os.path.join(out_path, 'bench.min.png'), optimize=True), repeat),
+        'convert_p_png': timeit(lambda: output.save_atomic(img.convert('P'), os.path.join(out_path, 'bench.p.png'), optimize=True), repeat),
+        'json': timeit(lambda: output.save_json_atomic({'name': 'NFT #bench', 'attributes': attributes}, os.path.join(out_path, 'bench.json')), repeat),
+        'write_item': timeit(lambda: output.write_item(img, 'bench', {}, 'NFT #', attributes, item_path), repeat),
+    }
+    results['min_png_bytes'] = {
+        'shared_palette': os.path.getsize(os.path.join(out_path, 'bench.min.png')),
+        'convert_p': os.path.getsize(os.path.join(out_path, 'bench.p.png')),
+    }
+    return results
+
+
+def environment() -> dict:
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'cpus': os.cpu_count(),
+        'timestamp': time.time(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compositing benchmark, or full suite on synthetic collection with --suite')
+    parser.add_argument('--layers', default=15, type=int)
+    parser.add_argument('--width', default=1080, type=int)
+    parser.add_argument('--height', default=1080, type=int)
+    parser.add_argument('--repeat', default=3, type=int)
+    parser.add_argument('--suite', help='Time traits loading, healthcheck, compositing and saving on synthetic collection', action='store_true')
+    parser.add_argument('--groups', help='Groups of synthetic collection', default=10, type=int)
+    parser.add_argument('--traits', help='Traits per group of synthetic collection', default=10, type=int)
+    parser.add_argument('--constraints', help='Share of traits with exclude and with adapted variant', default=0.1, type=float)
+    parser.add_argument('--svg-share', help='Share of svg layer files', default=0.2, type=float)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--path', help='Keep synthetic collection in this folder instead of temporary one', default=None)
+    parser.add_argument('--output', help='Also write JSON results to this file', default=None)
+    args = parser.parse_args()
+    if args.suite:
+        config = {k: getattr(args, k) for k in ('groups', 'traits', 'constraints', 'width', 'height', 'svg_share', 'repeat', 'seed')}
+        with tempfile.TemporaryDirectory() as tmp_path:
+            path = tmp_path if args.path == None else args.path
+            results = bench_suite(path, args.groups, args.traits, args.constraints, args.width, args.height, args.svg_share, args.repeat, args.seed)
+        report = {'environment': environment(), 'config': config, 'results': results}
+    else:
+        report = bench_compositor(args.layers, args.width, args.height, args.repeat)
+    print(json.dumps(report, indent=4))
+    if args.output != None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,233 @@
+import json
+from collections import Counter
+
+
+class Space:
+    """
+    Space of valid trait selections of loaded groups
+
+    Each trait (variant) reduced to titles which must not be selected (its exclude and
+    adapted-to of other variants of same title, the same rules as traits.check_selection)
+    and titles of which at least one must be selected (its adapted-to). Groups linked by
+    these rules form independent components, each counted by backtracking (most linked
+    groups first), pruning as soon as rule is broken and memoizing by the part of
+    assignment which rules of not assigned groups can see. With order all groups are
+    one component assigned in this order (e.g. layer order for rendering).
+    """
+    def __init__(self, groups, order=None):
+        self.groups = groups
+        self.title_groups = {}
+        for pos, group in enumerate(groups):
+            for trait in group['traits']:
+                self.title_groups.setdefault(trait['title'], set()).add(pos)
+
+        self.probability = []
+        self.rules = []
+        links = [set() for _ in groups]
+        for pos, group in enumerate(groups):
+            weights = {}
+            for trait in group['traits']:
+                weights.setdefault(trait['title'], trait['weight'] if 'weight' in trait else 1)
+            total = sum(weights.values())
+            self.probability.append([weights[trait['title']] / total if total > 0 else 0 for trait in group['traits']])
+            group_rules = []
+            for trait in group['traits']:
+                forbidden = set(trait['exclude']) if 'exclude' in trait else set()
+                current_adapted = trait['adapted-to'] if 'adapted-to' in trait else None
+                for variant in group['traits']:
+                    if variant['title'] == trait['title'] and 'adapted-to' in variant and variant['adapted-to'] != current_adapted:
+                        forbidden.update(variant['adapted-to'])
+                forbidden = frozenset(t for t in forbidden if t in self.title_groups)
+                required = None
+                required_groups = frozenset()
+                if current_adapted != None:
+                    required = frozenset(t for t in current_adapted if t in self.title_groups)
+                    required_groups = frozenset(p for t in required for p in self.title_groups[t])
+                group_rules.append((forbidden, required, required_groups))
+                for t in forbidden.union(required or ()):
+                    for other in self.title_groups[t]:
+                        if other != pos:
+                            links[pos].add(other)
+                            links[other].add(pos)
+            self.rules.append(group_rules)
+        self.links = links
+
+        self.order = list(range(len(groups))) if order == None else list(order)
+        self.components = [] if order == None else [list(order)]
+        seen = set(pos for component in self.components for pos in component)
+        for start in range(len(groups)):
+            if start in seen:
+                continue
+            component = [start]
+            seen.add(start)
+            for pos in component:
+                for other in sorted(links[pos]):
+                    if other not in seen:
+                        seen.add(other)
+                        component.append(other)
+            self.components.append(self.assign_order(component))
+        self.memo = [{} for _ in self.components]
+        # for every depth of component: titles of groups not assigned yet and
+        # titles referenced by their rules, the only parts of assignment future depends on
+        self.future_titles = []
+        self.future_refs = []
+        for order in self.components:
+            future_titles = []
+            future_refs = []
+            for depth in range(len(order) + 1):
+                later = order[depth:]
+                future_titles.append(frozenset(trait['title'] for pos in later for trait in groups[pos]['traits']))
+                future_refs.append(frozenset(t for pos in later for forbidden, required, _ in self.rules[pos] for t in forbidden.union(required or ())))
+            self.future_titles.append(future_titles)
+            self.future_refs.append(future_refs)
+
+    def assign_order(self, component) -> list:
+        """
+        Order groups of component so every next group has most links to already
+        assigned ones: rules get decided early and fewer groups stay linked to the rest
+        """
+        order = [component[0]]
+        rest = set(component[1:])
+        while len(rest) > 0:
+            assigned = set(order)
+            pos = max(sorted(rest), key=lambda p: len(self.links[p] & assigned))
+            order.append(pos)
+            rest.discard(pos)
+        return order
+
+    def state(self, c, depth, assignment, selected):
+        """
+        Return memo key: selected titles referenced by later groups, titles later groups
+        must avoid and pending adapted-to alternatives later groups must provide
+        """
+        order = self.components[c]
+        future_titles = self.future_titles[c][depth]
+        refs = frozenset(t for t in selected if t in self.future_refs[c][depth])
+        forbidden = set()
+        pending = set()
+        for i, k in enumerate(assignment):
+            trait_forbidden, required, _ = self.rules[order[i]][k]
+            forbidden.update(t for t in trait_forbidden if t in future_titles)
+            if required != None and not any(t in selected for t in required):
+                pending.add(frozenset(t for t in required if t in future_titles))
+        return (depth, refs, frozenset(forbidden), frozenset(pending))
+
+    def broken(self, pos, k, selected, assigned) -> bool:
+        """Return True if rules of trait k of group pos can not be satisfied anymore"""
+        forbidden, required, required_groups = self.rules[pos][k]
+        if any(t in selected for t in forbidden):
+            return True
+        if required != None and not any(t in selected for t in required) and required_groups <= assigned:
+            return True
+        return False
+
+    def extend(self, order, depth, assignment, selected, assigned, k) -> bool:
+        """Assign trait k to group at depth, return False (and undo) if any assigned rule broken"""
+        pos = order[depth]
+        assignment.append(k)
+        selected[self.groups[pos]['traits'][k]['title']] += 1
+        assigned.add(pos)
+        for i, assigned_k in enumerate(assignment):
+            if self.broken(order[i], assigned_k, selected, assigned):
+                self.undo(order, depth, assignment, selected, assigned)
+                return False
+        return True
+
+    def undo(self, order, depth, assignment, selected, assigned):
+        pos = order[depth]
+        title = self.groups[pos]['traits'][assignment.pop()]['title']
+        selected[title] -= 1
+        if selected[title] == 0:
+            del selected[title]
+        assigned.discard(pos)
+
+    def count_component(self, c, depth=0, assignment=None, selected=None, assigned=None) -> tuple:
+        """Return (count, probability mass) of valid completions of component c from depth"""
+        order = self.components[c]
+        if assignment == None:
+            assignment, selected, assigned = [], Counter(), set()
+        if depth == len(order):
+            return 1, 1.0
+        key = self.state(c, depth, assignment, selected)
+        if key in self.memo[c]:
+            return self.memo[c][key]
+        pos = order[depth]
+        count = 0
+        mass = 0.0
+        for k in range(len(self.groups[pos]['traits'])):
+            if self.extend(order, depth, assignment, selected, assigned, k):
+                sub_count, sub_mass = self.count_component(c, depth + 1, assignment, selected, assigned)
+                count += sub_count
+                mass += self.probability[pos][k] * sub_mass
+                self.undo(order, depth, assignment, selected, assigned)
+        self.memo[c][key] = (count, mass)
+        return count, mass
+
+    def count(self) -> dict:
+        """Return number of valid selections and their probability under weighted random choice"""
+        count = 1
+        mass = 1.0
+        for c in range(len(self.components)):
+            sub_count, sub_mass = self.count_component(c)
+            count *= sub_count
+            mass *= sub_mass
+        return {'count': count, 'probability': mass, 'components': len(self.components)}
+
+    def component_selections(self, c, depth, assignment, selected, assigned):
+        """Yield valid assignments of component c, subtrees without valid completion skipped"""
+        order = self.components[c]
+        if depth == len(order):
+            yield tuple(assignment)
+            return
+        pos = order[depth]
+        for k in range(len(self.groups[pos]['traits'])):
+            if self.extend(order, depth, assignment, selected, assigned, k):
+                if self.count_component(c, depth + 1, assignment, selected, assigned)[0] > 0:
+                    yield from self.component_selections(c, depth + 1, assignment, selected, assigned)
+                self.undo(order, depth, assignment, selected, assigned)
+
+    def assignments(self, c=0, partial=None):
+        """
+        Yield tuples of trait indexes of all valid selections, one per group in order
+        given to Space (groups order without it). With order they come depth first in
+        this order, so selections sharing first groups follow each other.
+        """
+        partial = {} if partial == None else partial
+        if c == len(self.components):
+            yield tuple(partial[pos] for pos in self.order)
+            return
+        order = self.components[c]
+        for assignment in self.component_selections(c, 0, [], Counter(), set()):
+            for pos, k in zip(order, assignment):
+                partial[pos] = k
+            yield from self.assignments(c + 1, partial)
+
+    def selections(self):
+        """Yield tuples of traits (one per group, in groups order) of all valid selections, see assignments"""
+        for assignment in self.assignments():
+            trait_of = dict(zip(self.order, assignment))
+            yield tuple(group['traits'][trait_of[pos]] for pos, group in enumerate(self.groups))
+
+
+def count(groups) -> dict:
+    return Space(groups).count()
+
+
+def combinations(groups):
+    """Lazy generator over valid selections, see Space.selections"""
+    return Space(groups).selections()
+
+
+if __name__ == '__main__':
+    import argparse
+    import traits
+    parser = argparse.ArgumentParser(description='Count valid trait combinations')
+    parser.add_argument('file', nargs='?', default='traits.json')
+    parser.add_argument('--list', help='Print first N valid combinations', default=0, type=int)
+    args = parser.parse_args()
+    space = Space(traits.load(args.file, verbose=False))
+    print(json.dumps(space.count(), indent=4))
+    for i, selection in enumerate(space.selections()):
+        if i >= args.list:
+            break
+        print(', '.join('%s: %s' % (group['group'], trait['title']) for group, trait in zip(space.groups, selection)))
@@ -0,0 +1,96 @@
+import numpy as np
+from PIL import Image
+
+
+def to_array(img: Image.Image) -> np.ndarray:
+    """Return RGBA image as uint8 array of shape (height, width, 4)"""
+    return np.asarray(img.convert('RGBA'))
+
+
+def to_image(arr: np.ndarray) -> Image.Image:
+    return Image.fromarray(arr, 'RGBA')
+
+
+class Layer:
+    """
+    Layer cropped to bounding box of its not transparent pixels
+
+    data is uint8 RGBA of box placed at (x, y), shape is (height, width, 4)
+    of full layer, so cropped layer is used in place of full array. opaque is True
+    when whole box has alpha 255, such layer is pasted instead of blended.
+    """
+    data: np.ndarray
+    x: int
+    y: int
+    opaque: bool
+
+    def __init__(self, data: np.ndarray, x=0, y=0, shape=None, opaque=False):
+        self.data = data
+        self.x = x
+        self.y = y
+        self.shape = data.shape if shape == None else shape
+        self.opaque = opaque
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+
+def crop(arr: np.ndarray) -> Layer:
+    """Return layer of array cropped to alpha bounding box, array kept as is when nothing to crop"""
+    alpha = arr[..., 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if len(rows) == 0:
+        return Layer(np.zeros((0, 0, 4), dtype=np.uint8), 0, 0, arr.shape)
+    cols = np.flatnonzero(alpha.any(axis=0))
+    y0, y1 = int(rows[0]), int(rows[-1]) + 1
+    x0, x1 = int(cols[0]), int(cols[-1]) + 1
+    opaque = bool(alpha[y0:y1, x0:x1].min() == 255)
+    if (y1 - y0, x1 - x0) == arr.shape[:2]:
+        return Layer(arr, opaque=opaque)
+    return Layer(np.ascontiguousarray(arr[y0:y1, x0:x1]), x0, y0, arr.shape, opaque)
+
+
+def placed(layer):
+    """Return (data, x, y) of Layer or plain array placed at (0,0)"""
+    if isinstance(layer, Layer):
+        return layer.data, layer.x, layer.y
+    return layer, 0, 0
+
+
+def composite(layers: list, size=None) -> Image.Image:
+    """
+    Alpha composite ordered list of RGBA layers (bottom first) into new image
+
+    Layers are uint8 arrays, cropped Layer objects or images (e.g. cached composite of
+    lower groups). Canvas size is (height, width) of first layer if size not provided,
+    smaller layers placed at (0,0) like Image.paste does. First layer is copied into
+    canvas once, every next one is blended by Pillow's alpha_composite over its box
+    only (opaque boxes pasted). Visible pixels equal sequential Image.alpha_composite of full frames, fully
+    transparent ones outside boxes are 0,0,0,0.
+    """
+    if len(layers) == 0:
+        return None
+    first = layers[0]
+    height, width = size if size != None else ((first.height, first.width) if isinstance(first, Image.Image) else first.shape[:2])
+    canvas = None
+    for layer in layers:
+        if isinstance(layer, Image.Image):
+            img, x, y = layer, 0, 0
+        else:
+            data, x, y = placed(layer)
+            data = data[:height - y, :width - x]
+            if data.size == 0:
+                continue
+            img = to_image(data)
+        if canvas is None:
+            if (x, y) == (0, 0) and img.size == (width, height):
+                canvas = img.copy()
+            else:
+                canvas = Image.new('RGBA', (width, height))
+                canvas.paste(img, (x, y))
+        elif isinstance(layer, Layer) and layer.opaque:
+            canvas.paste(img, (x, y))
+        else:
+            canvas.alpha_composite(img, (x, y))
+    return canvas if canvas is not None else Image.new('RGBA', (width, height))
@@ -0,0 +1,234 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
+from PIL import Image
+import output
+from manifest import Manifest
+
+default_index_file = 'duplicates.jsonl'
+hash_size = 32
+# brightness step (of 255) neighbouring cells must differ by to set bit, so noise
+# of lossy encoding in flat areas does not flip bits
+hash_margin = 4
+# perceptual hashes differing in at most this many bits (of 3*hash_size*hash_size)
+# are same image: re-encoded or few changed pixels, while trait changes flip far more
+max_distance = 8
+
+
+def combination_key(attributes: list) -> str:
+    """Return hash of trait combination, independent from attributes order"""
+    canonical = json.dumps(sorted([a['trait_type'], a['value']] for a in attributes))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def perceptual_hash(img: Image.Image, size = hash_size, margin = hash_margin) -> str:
+    """
+    Return difference hash of each colour channel (3*size*size bits) as hex string, close for visually
+    identical images. Channels are premultiplied by alpha, so colour variants of same shapes and
+    transparent areas differ. Trait changes often touch small part of image, so hash is finer than usual 8x8
+    """
+    small = np.asarray(img.convert('RGBa').resize((size + 1, size), Image.BOX, reducing_gap=2.0), dtype=np.int16)[..., :3]
+    bits = np.packbits(small[:, 1:] > small[:, :-1] + margin)
+    return bits.tobytes().hex()
+
+
+def hash_distance(a: str, b: str) -> int:
+    """Return number of differing bits of two perceptual hashes"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+class HashBands:
+    """
+    Perceptual hashes searchable by Hamming distance
+
+    Hash is split into max_distance + 1 bands: hashes within max_distance bits differ in at most
+    max_distance bands, so they share at least one whole band. Only hashes sharing a band are
+    compared, every band is a dict lookup. Hashes of other length (older hash formats) are ignored.
+    """
+    length = 3 * hash_size * hash_size // 4
+
+    def __init__(self):
+        self.bands = {}
+
+    def keys(self, phash):
+        count = max_distance + 1
+        return [(i, phash[self.length * i // count:self.length * (i + 1) // count]) for i in range(count)]
+
+    def add(self, phash, index):
+        if phash == None or len(phash) != self.length:
+            return
+        for key in self.keys(phash):
+            self.bands.setdefault(key, []).append((phash, index))
+
+    def similar(self, phash) -> list:
+        """Return (distance, index) of hashes within max_distance, closest first"""
+        if phash == None or len(phash) != self.length:
+            return []
+        found = {}
+        for key in self.keys(phash):
+            for other, index in self.bands.get(key, ()):
+                if index not in found:
+                    distance = hash_distance(phash, other)
+                    if distance <= max_distance:
+                        found[index] = distance
+        return sorted((distance, index) for index, distance in found.items())
+
+
+class DuplicateItem(Exception):
+    """Item is same as saved one: reason is 'combination' or 'image', index is index of saved item"""
+    def __init__(self, reason, index):
+        super().__init__('same %s already in %s.png' % (reason, index))
+        self.reason = reason
+        self.index = index
+
+
+class DuplicateIndex:
+    """
+    Persistent index of saved items by trait combination and perceptual hash
+
+    Stored as append-only jsonl in out folder, one line per saved item,
+    so every save appends one line. Combination lookup is dict lookup, image lookup
+    finds items whose perceptual hash is within max_distance (see HashBands).
+    Missing index file is rebuilt from trait combinations of out folder manifest,
+    image hashes of those items are added by scan().
+    """
+    combinations: dict
+    images: HashBands
+
+    def __init__(self, path = output.default_out_path, file = default_index_file):
+        self.file = os.path.join(path, file)
+        self.combinations = {}
+        self.images = HashBands()
+        if os.path.isfile(self.file):
+            with open(self.file) as index_file:
+                for line in index_file:
+                    if line.strip() != '':
+                        self.remember(json.loads(line))
+        elif os.path.isdir(path):
+            self.rebuild_from_manifest(path)
+
+    def rebuild_from_manifest(self, path):
+        entries = []
+        for item in Manifest(path).entries():
+            attributes = [{'trait_type': t, 'value': v} for t, v in item['traits']]
+            entries.append({'index': item['index'], 'combination': combination_key(attributes), 'phash': None})
+        output.save_jsonl_atomic(entries, self.file)
+        for entry in entries:
+            self.remember(entry)
+        if len(entries) > 0:
+            print('Duplicates index rebuilt from manifest with %d items, run duplicates.py to add image hashes' % len(entries))
+
+    def remember(self, entry):
+        self.combinations.setdefault(entry['combination'], entry['index'])
+        self.images.add(entry['phash'], entry['index'])
+
+    def find(self, attributes: list, img: Optional[Image.Image] = None, phash: Optional[str] = None):
+        """
+        Return (reason, index) of already saved same item or None
+
+        Same combination is found at once, same image by closest perceptual hash
+        within max_distance (entries of older hash format never match, rebuild index
+        with scan() to hash them again).
+        """
+        combination = combination_key(attributes)
+        if combination in self.combinations:
+            return 'combination', self.combinations[combination]
+        if phash == None and img != None:
+            phash = perceptual_hash(img)
+        similar = self.images.similar(phash)
+        if len(similar) == 0:
+            return None
+        return 'image', similar[0][1]
+
+    def entry(self, file_index, attributes: list, img: Optional[Image.Image] = None, phash: Optional[str] = None) -> dict:
+        return {
+            'index': file_index,
+            'combination': combination_key(attributes),
+            'phash': perceptual_hash(img) if phash == None else phash,
+        }
+
+    def add(self, file_index, attributes: list, img: Optional[Image.Image] = None, phash: Optional[str] = None):
+        entry = self.entry(file_index, attributes, img, phash)
+        self.remember(entry)
+        with open(self.file, 'a') as index_file:
+            index_file.write(json.dumps(entry) + '\n')
+
+    def replace(self, entries: list):
+        """
+        Replace lines of items whose images changed (re-rendered) by given entries,
+        so old hashes of these items no longer match. Index file is rewritten once
+        """
+        replaced = set(entry['index'] for entry in entries)
+        kept = []
+        with open(self.file) as index_file:
+            for line in index_file:
+                if line.strip() != '':
+                    entry = json.loads(line)
+                    if entry['index'] not in replaced:
+                        kept.append(entry)
+        output.save_jsonl_atomic(kept + entries, self.file)
+        self.combinations = {}
+        self.images = HashBands()
+        for entry in kept + entries:
+            self.remember(entry)
+
+
+def scan_item(json_file) -> Optional[dict]:
+    """Return index entry for item json and its png, None if item is not complete"""
+    png_path = "%s.png" % json_file.rsplit('.', 1)[0]
+    if not os.path.isfile(png_path):
+        return None
+    with open(json_file) as f:
+        info = json.load(f)
+    if 'attributes' not in info:
+        return None
+    with Image.open(png_path) as img:
+        phash = perceptual_hash(img)
+    name = os.path.basename(json_file).split('.')[0]
+    return {'index': int(name) if name.isdigit() else name, 'combination': combination_key(info['attributes']), 'phash': phash}
+
+
+def scan(path = output.default_out_path, workers=None, file = default_index_file) -> dict:
+    """
+    Hash all items of out folder in process pool, rewrite index file
+    and return clusters of items with same combination or same image
+    """
+    json_files = [os.path.join(path, f) for f in os.listdir(path) if f.endswith('.json') and f.split('.')[0].isdigit()]
+    json_files.sort(key=lambda f: int(os.path.basename(f).split('.')[0]))
+    entries = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for entry in executor.map(scan_item, json_files, chunksize=max(1, min(256, len(json_files) // 64))):
+            if entry != None:
+                entries.append(entry)
+
+    output.save_jsonl_atomic(entries, os.path.join(path, file))
+
+    by_combination = {}
+    by_image = {}
+    cluster_of = {}
+    images = HashBands()
+    for entry in entries:
+        by_combination.setdefault(entry['combination'], []).append(entry['index'])
+        # item joins cluster of closest earlier similar item
+        similar = images.similar(entry['phash'])
+        cluster = cluster_of[similar[0][1]] if len(similar) > 0 else entry['index']
+        cluster_of[entry['index']] = cluster
+        by_image.setdefault(cluster, []).append(entry['index'])
+        images.add(entry['phash'], entry['index'])
+    return {
+        'items': len(entries),
+        'combination': [items for items in by_combination.values() if len(items) > 1],
+        'image': [items for items in by_image.values() if len(items) > 1],
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Rebuild duplicates index of out folder and print duplicate clusters as JSON')
+    parser.add_argument('path', nargs='?', default=output.default_out_path)
+    parser.add_argument('--workers', default=None, type=int)
+    args = parser.parse_args()
+    print(json.dumps(scan(args.path, args.workers), indent=4))
@@ -1,13 +1,20 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter import font
-from PIL import Image, ImageTk
-from cairosvg import svg2png
-from io import BytesIO
+from PIL import Image
 from typing import Optional
-import os
 import json
 import traits
+import duplicates
+import output
+from manifest import Manifest
+from writer import SaveQueue
+from rarity import RarityStats
+import palette
+from layers import LayerCache
+from compositor import Layer
+from profiler import profiler
+import compositor
 from widget.image_viewer import ImageViewer
 from widget.vscroll_frame import VerticalScrolledFrame
 
@@ -15,10 +22,20 @@ from widget.vscroll_frame import VerticalScrolledFrame
 class Editor(tk.Tk):
     svg_options = { "default": { "width": 1080, "height": 1080 } }
     name_prefix = ""
+    save_poll_ms = 100
+    profile_overlay_ms = 500
 
     def __init__(self, args, **kwargs):
         tk.Tk.__init__(self, **kwargs)
 
+        self.layer_cache = LayerCache(budget_mb=args.layer_cache_mb)
+        self.duplicates = duplicates.DuplicateIndex()
+        self.pending_saves = {}
+        self.manifest = Manifest()
+        self.rarity = RarityStats()
+        self.rarity.build_in_background()
+        palette_loader = (lambda: palette.load(self.traits, self.svg_options['default']['width'], self.svg_options['default']['height'])) if args.shared_palette else None
+        self.save_queue = SaveQueue(palette_loader=palette_loader, variants=output.load_variants(args.variants), index=self.duplicates)
         self.load_traits('traits.json')
         self.load_blueprint_template(args.blueprint)
 
@@ -40,6 +57,10 @@ class Editor(tk.Tk):
         self.choice_frame.grid(row=0,column=1, sticky='nwes')
         self.choice_frame.columnconfigure(0, weight=1)
         self.choice_frame.inner.columnconfigure(0, weight=1)
+        self.italic_font = font.Font(self, font=('system', 12))
+        self.italic_font.configure(slant='italic')
+        self.choices = {}
+        self.build_dependents()
         for trait in self.traits:
             self.add_to_choice(trait)
 
@@ -53,6 +74,15 @@ class Editor(tk.Tk):
         self.saved_info.grid(row=1, column=0)
 
         self.recheck_states()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(self.save_poll_ms, self.poll_save_queue)
+
+        self.profile_overlay = None
+        if profiler.enabled:
+            self.profile_overlay = tk.Label(master=self.image_viewer, justify='left', anchor='nw', font=('monospace', 9), background='#FFFDE7')
+            self.profile_overlay.place(relx=1.0, rely=1.0, anchor='se')
+            profiler.add_counters('layer_cache', self.layer_cache.stats)
+            self.after(self.profile_overlay_ms, self.update_profile_overlay)
     
     def load_traits(self, file):
         self.traits = traits.load(file)
@@ -68,6 +98,8 @@ class Editor(tk.Tk):
 
         choice = tk.Frame(master=self.choice_frame.inner, name=trait['group'])
         choice.trait = trait
+        choice.state = None
+        self.choices[trait['group']] = choice
         choice.columnconfigure(1, weight=1)
         title = tk.Label(master=choice, text="%s" % trait['group'], width=lbl_width, borderwidth = 3, font=font_bold, anchor='w')
         filename = tk.Label(master=choice, width=lbl_width, font=font, name="filename_lbl")
@@ -75,6 +107,10 @@ class Editor(tk.Tk):
         conditions = tk.Frame(master=choice, name="conditions_frm")
         excludes = tk.Frame(master=choice, name="excludes_frm")
         mod_available = tk.Label(master=choice, name="mod_available_frm")
+        for frame in (conditions, excludes, mod_available):
+            frame.lines = []
+            frame.visible = 0
+            tk.Frame(frame, height=1, width=1).pack() #hack to resize frame when all lines hidden
         separator=ttk.Separator(master=choice, orient='horizontal')
         prev = tk.Button(master=choice, text="<",  width=1, name="prev_btn", command=lambda: self.prev_trait(trait, choice))
         if self.prev_trait_index(trait) == None:
@@ -118,10 +154,12 @@ class Editor(tk.Tk):
     def next_trait(self, trait: list, choice: tk.Frame):
         indx = self.next_trait_index(trait)
         if indx != None:
-            trait['current'] = trait['traits'][indx]
-            self.set_text(choice.children['filename_lbl'], trait['current']['title'])
-            self.image_viewer.set_image(self.combine_image(self.traits))
-            self.recheck_states()
+            with profiler.stage('trait_change'):
+                previous_title = trait['current']['title']
+                traits.select(self.traits, trait, trait['traits'][indx])
+                self.set_text(choice.children['filename_lbl'], trait['current']['title'])
+                self.image_viewer.set_image(self.combine_image(self.traits))
+                self.recheck_states(trait, previous_title)
 
         if self.prev_trait_index(trait) != None:
             choice.children['prev_btn'].configure(state='normal')
@@ -132,10 +170,12 @@ class Editor(tk.Tk):
     def prev_trait(self, trait: list, choice: tk.Frame):
         indx = self.prev_trait_index(trait)
         if indx != None:
-            trait['current'] = trait['traits'][indx]
-            self.set_text(choice.children['filename_lbl'], trait['current']['title'])
-            self.image_viewer.set_image(self.combine_image(self.traits))
-            self.recheck_states()
+            with profiler.stage('trait_change'):
+                previous_title = trait['current']['title']
+                traits.select(self.traits, trait, trait['traits'][indx])
+                self.set_text(choice.children['filename_lbl'], trait['current']['title'])
+                self.image_viewer.set_image(self.combine_image(self.traits))
+                self.recheck_states(trait, previous_title)
 
         if self.next_trait_index(trait) != None:
             choice.children['next_btn'].configure(state='normal')
@@ -143,145 +183,174 @@ class Editor(tk.Tk):
             choice.children['prev_btn'].configure(state='disabled')
 
 
-    def recheck_conditions(self):
-        for choice in self.choice_frame.inner.winfo_children():
-            conditions: tk.Frame = choice.children['conditions_frm'] 
-            for child in conditions.winfo_children():
-                child.destroy()
-            tk.Frame(conditions, height=1, width=1).pack() #hack to resize frame after cleanup
-            if 'adapted-to' in choice.trait['current']:
-                label = tk.Label(master=conditions, text='adapted to', font=('system italic', 12), foreground="#757575", pady=10)
-                f = tk.font.Font(label, label.cget('font'))
-                f.configure(slant='italic')
-                label.configure(font=f)
-                label.pack()
-
-                for cond in choice.trait['current']['adapted-to']:
-                    label = tk.Label(master=conditions, text=cond, font=('system', 12), foreground="#757575")
-                    if traits.check_condition([cond], self.traits) == True:
-                        label['foreground'] = '#2E7D32'
-                    else:
-                        label['foreground'] = '#BF360C'
-                    label.pack()
-
-    def recheck_excludes(self):
-        for choice in self.choice_frame.inner.winfo_children():
-            excludes: tk.Frame = choice.children['excludes_frm'] 
-            for child in excludes.winfo_children():
-                child.destroy()
-            tk.Frame(excludes, height=1, width=1).pack() #hack to resize frame after cleanup
-            if 'exclude' in choice.trait['current'] and traits.check_exclude(choice.trait['current']['exclude'], self.traits):
-                label = tk.Label(master=excludes, text='exclude', font=('system italic', 12), foreground="#757575", pady=10)
-                f = tk.font.Font(label, label.cget('font'))
-                f.configure(slant='italic')
-                label.configure(font=f)
-                label.pack()
-
-                for exc in choice.trait['current']['exclude']:        
-                    if traits.check_exclude([exc], self.traits) == True:
-                        label = tk.Label(master=excludes, text=exc, font=('system', 12), foreground="#757575")
-                        label['foreground'] = '#BF360C'
-                    label.pack()
-
-    def recheck_mod_available(self):
-        for choice in self.choice_frame.inner.winfo_children():
-            mod_available: tk.Frame = choice.children['mod_available_frm'] 
-            for child in mod_available.winfo_children():
-                child.destroy()
-            tk.Frame(mod_available, height=1, width=1).pack() #hack to resize frame after cleanup
-
-            ok, cond = traits.check_adapted_exists(choice.trait['current'], choice.trait, self.traits)
-            if ok == True:
-                label = tk.Label(master=mod_available, text='mod available for', font=('system', 12), foreground="#BF360C", pady=10)
-                label.pack()
-                for c in cond:
-                    label_cond = tk.Label(master=mod_available, text=c, font=('system', 12), foreground="#757575")
-                    label_cond.pack() 
+    def build_dependents(self):
+        """
+        Map trait title to groups whose side panel depends on it being selected:
+        titles in exclude and adapted-to of any trait of group
+        """
+        self.dependents = {}
+        for group in self.traits:
+            for trait in group['traits']:
+                for title in (trait['exclude'] if 'exclude' in trait else []) + (trait['adapted-to'] if 'adapted-to' in trait else []):
+                    self.dependents.setdefault(title, set()).add(group['group'])
+
+    def panel_state(self, trait) -> tuple:
+        """Return (adapted-to conditions with state, active excludes, mod available for) of current trait of group"""
+        current = trait['current']
+        conditions = None
+        if 'adapted-to' in current:
+            conditions = tuple((cond, traits.check_condition([cond], self.traits)) for cond in current['adapted-to'])
+        excludes = ()
+        if 'exclude' in current:
+            excludes = tuple(exc for exc in current['exclude'] if traits.check_exclude([exc], self.traits))
+        ok, cond = traits.check_adapted_exists(current, trait, self.traits)
+        return conditions, excludes, tuple(cond) if ok == True else ()
+
+    def show_lines(self, frame, lines: list):
+        """Show lines (text, font, foreground, pady) in frame, labels reused and only extra ones hidden"""
+        for i, (text, line_font, foreground, pady) in enumerate(lines):
+            if i == len(frame.lines):
+                frame.lines.append(tk.Label(master=frame))
+            frame.lines[i].configure(text=text, font=line_font, foreground=foreground, pady=pady)
+            if i >= frame.visible:
+                frame.lines[i].pack()
+        for label in frame.lines[len(lines):frame.visible]:
+            label.pack_forget()
+        frame.visible = len(lines)
+
+    def recheck_group(self, choice):
+        """Redraw conditions, excludes and mod available of group when its state changed"""
+        state = self.panel_state(choice.trait)
+        if state == choice.state:
+            return
+        choice.state = state
+        conditions, excludes, mod = state
+        normal = ('system', 12)
+        lines = []
+        if conditions != None:
+            lines.append(('adapted to', self.italic_font, '#757575', 10))
+            lines += [(cond, normal, '#2E7D32' if ok else '#BF360C', 1) for cond, ok in conditions]
+        self.show_lines(choice.children['conditions_frm'], lines)
+        lines = []
+        if len(excludes) > 0:
+            lines.append(('exclude', self.italic_font, '#757575', 10))
+            lines += [(exc, normal, '#BF360C', 1) for exc in excludes]
+        self.show_lines(choice.children['excludes_frm'], lines)
+        lines = []
+        if len(mod) > 0:
+            lines.append(('mod available for', normal, '#BF360C', 10))
+            lines += [(c, normal, '#757575', 1) for c in mod]
+        self.show_lines(choice.children['mod_available_frm'], lines)
 
     def recheck_save_button_state(self):
-        excluded = False
-        not_adapted = False
-        adapted_exists = False
-        for trait in self.traits:
-            if 'current' in trait:
-                current = trait['current']
-                if 'exclude' in current and traits.check_exclude(current['exclude'], self.traits):
-                    excluded = True
-                if 'adapted-to' in current and not traits.check_condition(current['adapted-to'], self.traits):
-                    not_adapted = True
-                ok, adapted = traits.check_adapted_exists(current, trait, self.traits)
-                if ok:
-                    adapted_exists = True
-        if excluded or not_adapted or adapted_exists:
-            self.save_button.configure(state = 'disabled')
-        else:
+        if traits.check_selection(self.traits):
             self.save_button.configure(state = 'normal')
+        else:
+            self.save_button.configure(state = 'disabled')
 
-    def recheck_states(self):
-        self.recheck_conditions()
-        self.recheck_excludes()
-        self.recheck_mod_available()
-        self.recheck_save_button_state()
-        self.saved_info.configure(text='')
-
-    def open_image(self, file) -> Image.Image:
-        if file.endswith('.svg'):
-            new_bites = svg2png(file_obj=open(file, "rb"), unsafe=True, write_to=None, scale=1, output_width=self.svg_options['default']['width'], output_height=self.svg_options['default']['height'])
-            return Image.open(BytesIO(new_bites)).convert('RGBA')
-        return Image.open(file).convert('RGBA')
+    def recheck_states(self, trait=None, previous_title=None):
+        """
+        Refresh side panel after current trait of group changed from previous_title:
+        only this group and groups depending on old or new title are rechecked, all without trait
+        """
+        with profiler.stage('recheck_states'):
+            if trait == None:
+                choices = self.choices.values()
+            else:
+                names = {trait['group']} | self.dependents.get(previous_title, set()) | self.dependents.get(trait['current']['title'], set())
+                choices = [self.choices[name] for name in names]
+            for choice in choices:
+                self.recheck_group(choice)
+            self.recheck_save_button_state()
+            self.saved_info.configure(text='')
+
+    def open_image(self, file) -> Layer:
+        """Return decoded layer from cache, file decoded only on first use"""
+        return self.layer_cache.get(file, self.svg_options['default']['width'], self.svg_options['default']['height'])
 
     def combine_image(self, layers: list) -> Optional[Image.Image]:
+        """
+        Composite current traits of all groups bottom up
+
+        Intermediate result after each group is kept in composite slot of its depth in
+        layer_cache with key of trait choices up to this group, so change of group k
+        recomposite only groups k..n unless composites below it were evicted
+        """
         result = None
-        for layer in layers:
+        key = ()
+        for depth, layer in enumerate(layers):
             if 'current' in layer:
                 files = layer['current']['file']
+                key += tuple(self.layer_cache.key(file, self.svg_options['default']['width'], self.svg_options['default']['height']) for file in files)
+                if len(files) == 0:
+                    continue
+                cached = self.layer_cache.get_composite(depth, key)
+                if cached is not None:
+                    result = cached
+                    continue
+                stack = [] if result is None else [result]
                 for file in files:
                     img = self.open_image(file)
-                    if result == None:
-                        result = img
-                        self.svg_options['default']['width'] = img.width
-                        self.svg_options['default']['height'] = img.height
-                    else:
-                        aimg = Image.new('RGBA', result.size)
-                        aimg.paste(img, (0,0))
-                        result = Image.alpha_composite(result, aimg)
+                    if result is None and len(stack) == 0:
+                        self.svg_options['default']['width'] = img.shape[1]
+                        self.svg_options['default']['height'] = img.shape[0]
+                    stack.append(img)
+                with profiler.stage('composite'):
+                    result = compositor.composite(stack)
+                self.layer_cache.put_composite(depth, key, result)
 
         return result
 
-    def out_file_list(self):
-        """Return png file list from out folder with numeric names, sorted desc"""
-
-        files = [f for f in os.listdir("./out") if f.endswith('.png') and not f.endswith('.min.png')]
-        return sorted(files, key=lambda x:int(x.split('.')[0]) if x.split('.')[0].isdigit() else -1, reverse=True)
-
-    def next_out_file_index(self):
-        list = self.out_file_list()
-        if len(list) == 0:
-            return 1
-        else:
-            last = list[0]
-            indx = int(last.split('.')[0])
-            return indx + 1
-    
     def save(self):
-        file_index = self.next_out_file_index()
-
+        """
+        Reserve index and hand item to background writer, result shown by on_saved.
+        Same combination is refused at once, same image by writer after hashing it
+        """
         img = self.image_viewer.source_image
-        img.save('./out/%s.png' % file_index)
-        optimized = img.convert('P')
-        optimized.save('./out/%s.min.png' % file_index)
-
-        self.blueprint_template['name'] = "%s%s" % (self.name_prefix, file_index)
-        self.blueprint_template['attributes'] = []
-        traits = []
-        for trait in self.traits:
-            if 'current' in trait:
-                data = trait.copy()
-                data.pop('files', None)
-                traits.append(data)
-            self.blueprint_template['attributes'].append({"trait_type": trait['group'], "value": trait['current']['title']})
-
-        with open('./out/%s.json' % file_index, 'w') as outfile:
-            json.dump(self.blueprint_template, outfile)
-
-        self.saved_info.configure(text='File saved to ./out/%s.png' % file_index)
\ No newline at end of file
+        attributes = [{"trait_type": trait['group'], "value": trait['current']['title']} for trait in self.traits]
+        found = self.duplicates.find(attributes)
+        if found != None:
+            reason, indx = found
+            self.saved_info.configure(text='Not saved, same %s already in ./out/%s.png' % (reason, indx))
+            return
+        combination = duplicates.combination_key(attributes)
+        for indx, pending in self.pending_saves.items():
+            if pending == combination:
+                self.saved_info.configure(text='Not saved, same combination is being saved to ./out/%s.png' % indx)
+                return
+        file_index = self.manifest.reserve()
+        self.pending_saves[file_index] = combination
+        layer_files = [file for trait in self.traits for file in trait['current']['file']]
+        self.save_queue.submit(img, file_index, self.blueprint_template, self.name_prefix, attributes, layer_files,
+                               on_done=lambda indx, records, error: self.on_saved(indx, attributes, records, error))
+        self.saved_info.configure(text='Saving ./out/%s.png (%d in queue)' % (file_index, self.save_queue.depth()))
+
+    def on_saved(self, file_index, attributes, records, error):
+        """Record finished save in manifest (writer added it to duplicates index), refused or failed one is only forgotten"""
+        self.pending_saves.pop(file_index)
+        if isinstance(error, duplicates.DuplicateItem):
+            self.saved_info.configure(text='Not saved, same %s already in ./out/%s.png' % (error.reason, error.index))
+            return
+        if error != None:
+            self.saved_info.configure(text='Saving ./out/%s.png failed: %s' % (file_index, error))
+            return
+        self.manifest.append(file_index, attributes, records)
+        self.rarity.add(file_index, attributes)
+        stats = self.save_queue.stats()
+        self.saved_info.configure(text='File saved to ./out/%s.png (%.2fs, %d in queue)' % (file_index, stats['last_encode_seconds'], stats['queued']))
+
+    def update_profile_overlay(self):
+        self.profile_overlay.configure(text=profiler.summary())
+        self.after(self.profile_overlay_ms, self.update_profile_overlay)
+
+    def poll_save_queue(self):
+        self.save_queue.poll()
+        self.after(self.save_poll_ms, self.poll_save_queue)
+
+    def on_close(self):
+        """Let queued saves finish before window closed"""
+        if self.save_queue.depth() > 0:
+            self.saved_info.configure(text='Waiting for %d saves...' % self.save_queue.depth())
+            self.update_idletasks()
+        self.save_queue.wait()
+        self.destroy()
@@ -0,0 +1,294 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from PIL import Image
+import traits
+import output
+import duplicates
+from manifest import Manifest
+import compositor
+import palette
+import layerstore
+import combinatorics
+from layers import LayerCache
+
+worker_state = {}
+
+
+def weighted_titles(group) -> tuple:
+    """Return unique trait titles of group and their weights, variants of same title share weight"""
+    titles = []
+    weights = []
+    for trait in group['traits']:
+        if trait['title'] not in titles:
+            titles.append(trait['title'])
+            weights.append(trait['weight'])
+    return titles, weights
+
+
+def resolve_variant(group, title, selected) -> Optional[dict]:
+    """
+    Return variant of trait which editor accepts for selected titles:
+    adapted variant if its condition matched, default variant otherwise
+    """
+    default = None
+    adapted = []
+    for trait in group['traits']:
+        if trait['title'] != title:
+            continue
+        if 'adapted-to' in trait:
+            if any(a in selected for a in trait['adapted-to']):
+                adapted.append(trait)
+        elif default == None:
+            default = trait
+    if len(adapted) == 1:
+        return adapted[0]
+    if len(adapted) == 0:
+        return default
+    return None
+
+
+def canvas_size(groups, svg_width, svg_height) -> tuple:
+    """
+    Return (width, height) workers composite at: size of first layer file of bottom
+    group, svg rendered with given size, like render_item and editor take it
+    """
+    for group in groups:
+        for trait in group['traits']:
+            for file in trait['file']:
+                if file.endswith('.svg'):
+                    return svg_width, svg_height
+                with Image.open(file) as img:
+                    return img.size
+    return svg_width, svg_height
+
+
+def random_selection(groups: traits.TraitGroups, rng: random.Random, choices) -> Optional[list]:
+    """
+    Pick one trait per group by weight and return groups copy with 'current' set,
+    None if selection is rejected by exclude or adapted-to rules
+    """
+    titles = [rng.choices(group_titles, weights=weights)[0] for group_titles, weights in choices]
+    selected = set(titles)
+    selection = []
+    for group, title in zip(groups, titles):
+        current = resolve_variant(group, title, selected)
+        if current == None:
+            return None
+        selection.append({'group': group['group'], 'traits': group['traits'], 'current': current})
+    if not groups.compiled.check_selection(selection, selected):
+        return None
+    return selection
+
+
+def init_worker(blueprint, name_prefix, out_path, svg_width, svg_height, cache_mb, shared_palette, variants=output.default_variants, store_file=None, images=None):
+    worker_state['palette'] = shared_palette
+    worker_state['variants'] = variants
+    worker_state['blueprint'] = blueprint
+    worker_state['name_prefix'] = name_prefix
+    worker_state['out_path'] = out_path
+    worker_state['svg_size'] = (svg_width, svg_height)
+    worker_state['cache'] = LayerCache(budget_mb=cache_mb, store=None if store_file == None else layerstore.LayerStore(store_file))
+    worker_state['layer_hashes'] = {}
+    worker_state['images'] = duplicates.HashBands() if images == None else images
+
+
+def composite_files(files, below: Optional[Image.Image] = None) -> Optional[Image.Image]:
+    """
+    Return composite of layer files over below (composite of lower groups) in worker process,
+    None if there is nothing to composite. Layers come from worker cache, svg rendered at
+    size of below or of first layer file, like Editor.combine_image takes it
+    """
+    cache: LayerCache = worker_state['cache']
+    svg_width, svg_height = worker_state['svg_size'] if below is None else below.size
+    layers = [] if below is None else [below]
+    for file in files:
+        layer = cache.get(file, svg_width, svg_height)
+        if len(layers) == 0:
+            svg_height, svg_width = layer.shape[:2]
+        layers.append(layer)
+    return compositor.composite(layers)
+
+
+def write_new_item(file_index, files, attributes, img: Image.Image) -> tuple:
+    """
+    Write item composited from layer files unless its image is same as image of item saved
+    before run (images given to init_worker), runs inside worker process.
+    Returns (file_index, attributes, phash, records, index of same saved item), records None if not written
+    """
+    phash = duplicates.perceptual_hash(img)
+    similar = worker_state['images'].similar(phash)
+    if len(similar) > 0:
+        return file_index, attributes, phash, None, similar[0][1]
+    layers_digest = output.files_digest(files, worker_state['layer_hashes'])
+    info = output.write_item(img, file_index, worker_state['blueprint'], worker_state['name_prefix'], attributes, worker_state['out_path'], worker_state['palette'], worker_state['variants'], layers_digest)
+    return file_index, attributes, phash, info['variants'], None
+
+
+def render_item(job):
+    """Composite layers of job and write item files, runs inside worker process"""
+    file_index, files, attributes = job
+    img = composite_files(files)
+    return write_new_item(file_index, files, attributes, img)
+
+
+def record_result(index: duplicates.DuplicateIndex, manifest: Manifest, result, done, total) -> bool:
+    """
+    Add item rendered by worker to duplicates index and manifest, return False if it was skipped:
+    refused by worker or same image as item written earlier in this run (its files are removed)
+    """
+    file_index, attributes, phash, records, same = result
+    if same == None:
+        found = index.find(attributes, phash=phash)
+        if found != None:
+            same = found[1]
+            output.remove_item(file_index, records, manifest.path)
+    if same != None:
+        print("Skipped %s.png, same image as %s.png" % (file_index, same))
+    else:
+        index.add(file_index, attributes, phash=phash)
+        manifest.append(file_index, attributes, records)
+    if done % 100 == 0 or done == total:
+        print("Generated %d/%d (%s.png)" % (done, total, file_index))
+    return same == None
+
+
+def generate(groups, count, blueprint, name_prefix, seed=None, workers=None, out_path=output.default_out_path, svg_width=1080, svg_height=1080, cache_mb=512, max_attempts=1000, variants=output.default_variants, layer_store=True, shared_palette=False):
+    """
+    Generate count unique items with weighted random traits selection
+
+    Selections are made in main process with seeded random, so same seed and traits
+    give same items. Combinations already saved in out folder are skipped, items with
+    same image as saved ones are not written. Compositing and png encoding are done in
+    process pool. With layer_store layers are decoded once into layerstore file mapped
+    by all workers. Returns number of items written.
+    """
+    rng = random.Random(seed)
+    choices = [weighted_titles(group) for group in groups]
+    index = duplicates.DuplicateIndex(out_path)
+    seen = set(index.combinations)
+    jobs = []
+    attempts = 0
+    while len(jobs) < count:
+        selection = random_selection(groups, rng, choices)
+        attributes = None if selection == None else [{"trait_type": trait['group'], "value": trait['current']['title']} for trait in selection]
+        key = None if selection == None else duplicates.combination_key(attributes)
+        if selection == None or key in seen:
+            attempts += 1
+            if attempts >= max_attempts:
+                print("Warning: no new valid combination found in %d attempts, generated %d of %d" % (max_attempts, len(jobs), count))
+                break
+            continue
+        seen.add(key)
+        files = [file for trait in selection for file in trait['current']['file']]
+        if len(files) == 0:
+            # nothing to composite, like render_tree_job skips it
+            print("Warning: %s skipped, its traits have no layer files" % ', '.join(a['value'] for a in attributes))
+            attempts += 1
+            continue
+        attempts = 0
+        jobs.append([None, files, attributes])
+
+    manifest = Manifest(out_path)
+    first_index = manifest.reserve(len(jobs))
+    for i, job in enumerate(jobs):
+        job[0] = first_index + i
+
+    start = time.perf_counter()
+    svg_width, svg_height = canvas_size(groups, svg_width, svg_height)
+    store_file = layerstore.load(groups, svg_width, svg_height, workers=workers) if layer_store else None
+    initargs = (blueprint, name_prefix, out_path, svg_width, svg_height, cache_mb, palette.load(groups, svg_width, svg_height) if shared_palette else None, variants, store_file, index.images)
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+        for done, result in enumerate(executor.map(render_item, jobs, chunksize=max(1, min(64, len(jobs) // 64))), 1):
+            written += record_result(index, manifest, result, done, len(jobs))
+    print("Done in %.1fs, %d written, %d skipped as same image" % (time.perf_counter() - start, written, len(jobs) - written))
+    return written
+
+
+def render_tree_job(job):
+    """
+    Render leaves of combination tree given in depth first order, runs inside worker process
+
+    Composite of groups 0..d is kept for every depth d and reused by following leaves
+    with same traits up to d, so only groups after first difference are blended.
+    Returns results of items and number of composites made.
+    """
+    files = worker_state['files']
+    stack = []
+    previous = ()
+    results = []
+    composites = 0
+    for file_index, assignment, attributes in job:
+        common = 0
+        while common < len(stack) and assignment[common] == previous[common]:
+            common += 1
+        del stack[common:]
+        for depth in range(common, len(assignment)):
+            # groups without files so far leave no composite (None), like Editor.combine_image
+            below = stack[-1] if len(stack) > 0 else None
+            if len(files[depth][assignment[depth]]) > 0:
+                stack.append(composite_files(files[depth][assignment[depth]], below))
+                composites += 1
+            else:
+                stack.append(below)
+        previous = assignment
+        img = stack[-1]
+        if img is None:
+            print("Warning: %s.png skipped, its traits have no layer files" % file_index)
+            continue
+        results.append(write_new_item(file_index, [file for depth, k in enumerate(assignment) for file in files[depth][k]], attributes, img))
+    return results, composites
+
+
+def init_tree_worker(files, *args):
+    init_worker(*args)
+    worker_state['files'] = files
+
+
+def generate_all(groups, blueprint, name_prefix, workers=None, out_path=output.default_out_path, svg_width=1080, svg_height=1080, cache_mb=512, variants=output.default_variants, layer_store=True, shared_palette=False):
+    """
+    Render every valid combination not saved yet, return number of items written
+
+    Combination tree is walked group by group in layer order, depth first, pruned by
+    combinatorics.Space as soon as exclude or adapted-to can not be satisfied. Leaves are
+    split into contiguous chunks for process pool; every chunk keeps one composite per
+    depth, so blending work follows number of tree nodes instead of leaves x groups.
+    Combinations with same image as saved item are skipped like in generate.
+    """
+    space = combinatorics.Space(groups, order=range(len(groups)))
+    index = duplicates.DuplicateIndex(out_path)
+    leaves = []
+    for assignment in space.assignments():
+        attributes = [{"trait_type": group['group'], "value": group['traits'][k]['title']} for group, k in zip(groups, assignment)]
+        if duplicates.combination_key(attributes) not in index.combinations:
+            leaves.append([None, assignment, attributes])
+    print("%d valid combinations not saved yet" % len(leaves))
+    if len(leaves) == 0:
+        return 0
+
+    manifest = Manifest(out_path)
+    first_index = manifest.reserve(len(leaves))
+    for i, leaf in enumerate(leaves):
+        leaf[0] = first_index + i
+    chunk = max(1, len(leaves) // ((workers or os.cpu_count() or 1) * 4))
+    jobs = [leaves[i:i + chunk] for i in range(0, len(leaves), chunk)]
+
+    start = time.perf_counter()
+    done = 0
+    total_composites = 0
+    files = [[trait['file'] for trait in group['traits']] for group in groups]
+    svg_width, svg_height = canvas_size(groups, svg_width, svg_height)
+    store_file = layerstore.load(groups, svg_width, svg_height, workers=workers) if layer_store else None
+    initargs = (files, blueprint, name_prefix, out_path, svg_width, svg_height, cache_mb, palette.load(groups, svg_width, svg_height) if shared_palette else None, variants, store_file, index.images)
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_tree_worker, initargs=initargs) as executor:
+        for results, composites in executor.map(render_tree_job, jobs):
+            total_composites += composites
+            for result in results:
+                done += 1
+                written += record_result(index, manifest, result, done, len(leaves))
+    print("Done in %.1fs, %d written, %d skipped as same image, %d composites for %d items (%d without shared prefixes)" % (time.perf_counter() - start, written, done - written, total_composites, len(leaves), len(leaves) * len(groups)))
+    return written
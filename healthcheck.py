@@ -1,42 +1,80 @@
-def same_trait_name(collection):
-    for group in collection:
-        if 'traits' in group:
-            for trait in group['traits']:
-                for other_group in collection:
-                    if 'traits' in other_group:
-                        for other_trait in other_group['traits']:
-                            if other_group['group'] != group['group'] and 'traits' in other_group and trait['title'] == other_trait['title']:
-                                print("Notice: traits '%s.%s' and '%s.%s' have same names" % (group['group'], trait['title'], other_group['group'], other_trait['title']))
-
-def trait_names(collection):
-    names = []
+import json
+
+
+def name_index(collection) -> dict:
+    """Return map of trait name to list of groups having trait with this name, built in one pass"""
+    names = {}
     for group in collection:
         if 'traits' in group:
             for trait in group['traits']:
-                names.append({'group': group['group'], 'name': trait['title']})
+                groups = names.setdefault(trait['title'], [])
+                if group['group'] not in groups:
+                    groups.append(group['group'])
     return names
 
-def adapted_for_unknown(collection):
+def finding(kind, group, trait, ref, message, verbose) -> dict:
+    """Return finding of check, ref is other group for same names or unknown referenced name"""
+    if verbose:
+        print(message)
+    return {'check': kind, 'group': group, 'trait': trait, 'ref': ref, 'message': message}
+
+def same_trait_name(collection, names=None, verbose=True) -> list:
+    names = name_index(collection) if names == None else names
+    findings = []
+    for name, groups in names.items():
+        for i, group in enumerate(groups):
+            for other_group in groups[i+1:]:
+                message = "Notice: traits '%s.%s' and '%s.%s' have same names" % (group, name, other_group, name)
+                findings.append(finding('same_trait_name', group, name, other_group, message, verbose))
+    return findings
+
+def adapted_for_unknown(collection, names=None, verbose=True) -> list:
+    names = name_index(collection) if names == None else names
+    findings = []
     for group in collection:
         if 'traits' in group:
-            traits = group['traits']
-            for trait in traits:
+            reported = set()
+            for trait in group['traits']:
                 if 'adapted-to' in trait:
                     for a in trait['adapted-to']:
-                        if not any(n['name'] == a for n in trait_names(collection)):
-                            print("Notice: '%s.%s' adapted to none existed trait name '%s'" % (group['group'], trait['title'], a))
+                        if a not in names and (trait['title'], a) not in reported:
+                            reported.add((trait['title'], a))
+                            message = "Notice: '%s.%s' adapted to none existed trait name '%s'" % (group['group'], trait['title'], a)
+                            findings.append(finding('adapted_for_unknown', group['group'], trait['title'], a, message, verbose))
+    return findings
 
-def excluded_for_unknown(collection):
+def excluded_for_unknown(collection, names=None, verbose=True) -> list:
+    names = name_index(collection) if names == None else names
+    findings = []
     for group in collection:
         if 'traits' in group:
-            traits = group['traits']
-            prev_name = ''
-            for trait in traits:
-                if trait['title'] == prev_name:
+            checked = set()
+            for trait in group['traits']:
+                if trait['title'] in checked:
                     continue
-                else:
-                    prev_name = trait['title']
+                checked.add(trait['title'])
                 if 'exclude' in trait:
                     for e in trait['exclude']:
-                        if not any(n['name'] == e for n in trait_names(collection)):
-                            print("Notice: '%s.%s' excluded for none existed trait name '%s'" % (group['group'], trait['title'], e))
+                        if e not in names:
+                            message = "Notice: '%s.%s' excluded for none existed trait name '%s'" % (group['group'], trait['title'], e)
+                            findings.append(finding('excluded_for_unknown', group['group'], trait['title'], e, message, verbose))
+    return findings
+
+def run(collection, verbose=True) -> dict:
+    """Run all checks with one shared name index and return report of findings by check"""
+    names = name_index(collection)
+    return {
+        'same_trait_name': same_trait_name(collection, names, verbose),
+        'adapted_for_unknown': adapted_for_unknown(collection, names, verbose),
+        'excluded_for_unknown': excluded_for_unknown(collection, names, verbose),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import traits
+    parser = argparse.ArgumentParser(description='Check traits file and print report as JSON')
+    parser.add_argument('file', nargs='?', default='traits.json')
+    args = parser.parse_args()
+    groups = traits.load(args.file, verbose=False)
+    print(json.dumps(groups.healthcheck, indent=4))
@@ -0,0 +1,126 @@
+import os
+from collections import OrderedDict
+from typing import Optional
+from PIL import Image
+from compositor import to_array, crop, Layer
+from svgcache import SvgCache
+from profiler import profiler
+
+svg_cache = SvgCache()
+
+
+def decode_layer(file, svg_width, svg_height) -> Image.Image:
+    """Read layer file from disk as RGBA image, svg rendered with given size through shared svg_cache"""
+    if file.endswith('.svg'):
+        return svg_cache.get(file, svg_width, svg_height)
+    return Image.open(file).convert('RGBA')
+
+
+class LayerCache:
+    """
+    LRU cache of decoded layers
+
+    Key is (path, file mtime, svg size), so edited files are decoded again
+    and svg layers rendered for another canvas size do not collide.
+    Layers are kept cropped to their alpha bounding box (compositor.Layer), so memory
+    is proportional to covered area. Least recently used layers are evicted when
+    memory budget is exceeded. Editor keeps its intermediate composites (images) in
+    separate slots, one per group depth of current selection, counted in same budget
+    but evicted before any layer (deepest first). With store (layerstore.LayerStore) layers found there
+    unchanged are returned from shared memory map and do not count to budget.
+    """
+    budget: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    mapped: int
+
+    def __init__(self, budget_mb=512, store=None):
+        self.budget = budget_mb * 1024 * 1024
+        self.store = store
+        self.mapped = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.items = OrderedDict()
+        self.composites = {}
+
+    def key(self, file, svg_width, svg_height):
+        svg_size = (svg_width, svg_height) if file.endswith('.svg') else None
+        return (file, os.stat(file).st_mtime_ns, svg_size)
+
+    def get(self, file, svg_width, svg_height) -> Layer:
+        """Return layer cropped to alpha bounding box, decoded only when not cached"""
+        key = self.key(file, svg_width, svg_height)
+        layer = self.items.get(key)
+        if layer is not None:
+            self.hits += 1
+            self.items.move_to_end(key)
+            return layer
+        if self.store is not None:
+            layer = self.store.get(file, key[1], key[2])
+            if layer is not None:
+                self.mapped += 1
+                return layer
+        self.misses += 1
+        with profiler.stage('decode'):
+            layer = crop(to_array(decode_layer(file, svg_width, svg_height)))
+        self.put(key, layer)
+        return layer
+
+    def put(self, key, layer: Layer):
+        if layer.nbytes > self.budget:
+            return
+        self.items[key] = layer
+        self.size += layer.nbytes
+        self.shrink()
+
+    def composite_size(self, img: Image.Image) -> int:
+        return img.width * img.height * len(img.getbands())
+
+    def get_composite(self, depth, key) -> Optional[Image.Image]:
+        """Return composite of groups up to depth if it was made for same key"""
+        cached = self.composites.get(depth)
+        if cached != None and cached[0] == key:
+            return cached[1]
+        return None
+
+    def put_composite(self, depth, key, img: Image.Image):
+        """Keep composite in slot of depth, replacing composite of previous selection"""
+        previous = self.composites.pop(depth, None)
+        if previous != None:
+            self.size -= self.composite_size(previous[1])
+        if self.composite_size(img) > self.budget:
+            return
+        self.composites[depth] = (key, img)
+        self.size += self.composite_size(img)
+        self.shrink()
+
+    def shrink(self):
+        """Evict composites (deepest first), then least recently used layers, until budget fits"""
+        while self.size > self.budget and len(self.composites) > 0:
+            _, img = self.composites.pop(max(self.composites))
+            self.size -= self.composite_size(img)
+        while self.size > self.budget:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self.items.clear()
+        self.composites.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'mapped': self.mapped,
+            'items': len(self.items),
+            'composites': len(self.composites),
+            'size': self.size,
+            'budget': self.budget,
+        }
@@ -0,0 +1,155 @@
+import os
+import mmap
+import json
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from compositor import Layer, crop, to_array
+from layers import decode_layer
+from palette import layer_files, files_key
+
+default_cache_path = './.cache'
+magic = b'NFTLAYR1'
+preamble = struct.Struct('<8sQQ')
+alignment = 64
+
+
+def decode_file(job) -> Layer:
+    file, svg_width, svg_height = job
+    return crop(to_array(decode_layer(file, svg_width, svg_height)))
+
+
+def read_header(file) -> dict:
+    """Return JSON header of store file"""
+    with open(file, 'rb') as f:
+        file_magic, header_offset, header_size = preamble.unpack(f.read(preamble.size))
+        if file_magic != magic:
+            raise ValueError('%s is not layer store' % file)
+        f.seek(header_offset)
+        return json.loads(f.read(header_size))
+
+
+def build(store_file, files, svg_width, svg_height, workers=None) -> int:
+    """
+    Decode layer files in process pool and write them into store_file, return its size
+
+    Layer bytes are streamed to file in order of files, so only pool results in flight
+    are held in memory. Header is written last and pointed to by preamble.
+    """
+    entries = {}
+    tmp_file = '%s.%s.tmp' % (store_file, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f, ProcessPoolExecutor(max_workers=workers) as executor:
+            f.write(bytes(alignment))
+            jobs = [(file, svg_width, svg_height) for file in files]
+            for file, layer in zip(files, executor.map(decode_file, jobs)):
+                stat = os.stat(file)
+                offset = f.tell()
+                f.write(np.ascontiguousarray(layer.data).tobytes())
+                f.write(bytes(-f.tell() % alignment))
+                entries[file] = {
+                    'mtime_ns': stat.st_mtime_ns,
+                    'offset': offset,
+                    'box': [layer.x, layer.y, layer.data.shape[1], layer.data.shape[0]],
+                    'shape': list(layer.shape),
+                    'opaque': layer.opaque,
+                }
+            header = json.dumps({'svg_size': [svg_width, svg_height], 'layers': entries}).encode('utf-8')
+            header_offset = f.tell()
+            f.write(header)
+            size = f.tell()
+            f.seek(0)
+            f.write(preamble.pack(magic, header_offset, len(header)))
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, store_file)
+    return size
+
+
+class LayerStore:
+    """
+    Read-only memory map of layers decoded by build()
+
+    File starts with preamble (magic, offset and length of JSON header), followed by
+    RGBA bytes of every layer cropped to its alpha bounding box at 64 byte aligned
+    offsets, header last. Header lists per file its mtime, offset, box (x, y, width,
+    height), full shape and whether box is opaque. Layers are read-only numpy views
+    into the map, so worker processes share page cache pages of one file instead of
+    decoding own copies.
+    """
+    def __init__(self, file):
+        self.file = file
+        with open(file, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, header_offset, header_size = preamble.unpack_from(self.mmap)
+        if file_magic != magic:
+            raise ValueError('%s is not layer store' % file)
+        header = json.loads(self.mmap[header_offset:header_offset + header_size])
+        self.svg_size = tuple(header['svg_size'])
+        self.entries = header['layers']
+        self.buffer = np.frombuffer(self.mmap, dtype=np.uint8)
+        self.layers = {}
+
+    def get(self, file, mtime_ns, svg_size=None):
+        """Return mapped layer of file, None when file not in store, changed since build or svg rendered for other size"""
+        entry = self.entries.get(file)
+        if entry is None or entry['mtime_ns'] != mtime_ns or (svg_size != None and tuple(svg_size) != self.svg_size):
+            return None
+        layer = self.layers.get(file)
+        if layer is None:
+            x, y, width, height = entry['box']
+            data = self.buffer[entry['offset']:entry['offset'] + height * width * 4].reshape(height, width, 4)
+            layer = self.layers[file] = Layer(data, x, y, tuple(entry['shape']), entry.get('opaque', False))
+        return layer
+
+    def stats(self) -> dict:
+        return {
+            'file': self.file,
+            'layers': len(self.entries),
+            'size': len(self.mmap),
+            'svg_size': list(self.svg_size),
+        }
+
+
+def load(groups, svg_width, svg_height, cache_path = default_cache_path, workers=None) -> str:
+    """
+    Return store file with every layer file of groups, built once and rebuilt when any
+    layer file changes. Stores of previous versions of same files and size are removed,
+    stores of other collections or sizes are kept for jobs which may have them mapped.
+    """
+    files = layer_files(groups)
+    store_file = os.path.join(cache_path, 'layers-%s.bin' % files_key(files, svg_width, svg_height))
+    if os.path.isfile(store_file):
+        return store_file
+    os.makedirs(cache_path, exist_ok=True)
+    size = build(store_file, files, svg_width, svg_height, workers)
+    print('Decoded %d layer files into %s (%.1f MB)' % (len(files), store_file, size / 1024 / 1024))
+    for name in os.listdir(cache_path):
+        old_file = os.path.join(cache_path, name)
+        if not name.startswith('layers-') or not name.endswith('.bin') or old_file == store_file:
+            continue
+        try:
+            header = read_header(old_file)
+            if header['svg_size'] == [svg_width, svg_height] and sorted(header['layers']) == files:
+                os.remove(old_file)
+        except (OSError, ValueError, struct.error) as exception:
+            print('Warning: skipped %s (%s)' % (old_file, exception))
+    return store_file
+
+
+if __name__ == '__main__':
+    import argparse
+    import traits
+    import generator
+    parser = argparse.ArgumentParser(description='Decode every layer of traits file into shared memory-mapped store')
+    parser.add_argument('traits_file', nargs='?', default='traits.json')
+    parser.add_argument('--svg-width', help='Canvas width if bottom layer is svg, like app.py --svg-width', default=1080, type=int)
+    parser.add_argument('--svg-height', help='Canvas height if bottom layer is svg, like app.py --svg-height', default=1080, type=int)
+    parser.add_argument('--workers', help='Worker processes (default: cpu count)', default=None, type=int)
+    args = parser.parse_args()
+    groups = traits.load(args.traits_file, verbose=False)
+    # same size as generator and rerender key their store by, otherwise it is built again
+    svg_width, svg_height = generator.canvas_size(groups, args.svg_width, args.svg_height)
+    store_file = load(groups, svg_width, svg_height, workers=args.workers)
+    print(json.dumps(LayerStore(store_file).stats()))
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import output
+
+default_manifest_file = 'manifest.jsonl'
+default_sequence_file = 'sequence'
+
+
+class Manifest:
+    """
+    Append-only list of saved items in out folder with atomic index sequence
+
+    manifest.jsonl has one line per item: index, file names (images as written by
+    output.write_images, json last), traits and timestamp.
+    sequence file holds next free index, changed under lock file and replaced
+    atomically, so parallel saves never get same index. Both are rebuilt from
+    folder content on first use or with rebuild().
+    """
+    lock_timeout = 10
+
+    def __init__(self, path = output.default_out_path, rebuild_missing=True):
+        self.path = path
+        self.manifest_file = os.path.join(path, default_manifest_file)
+        self.sequence_file = os.path.join(path, default_sequence_file)
+        self.lock_file = self.sequence_file + '.lock'
+        if rebuild_missing and not (os.path.isfile(self.manifest_file) and os.path.isfile(self.sequence_file)):
+            self.rebuild()
+
+    def lock(self):
+        start = time.monotonic()
+        while True:
+            try:
+                os.close(os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except FileExistsError:
+                if time.monotonic() - start > self.lock_timeout:
+                    print('Warning: removing stale lock %s' % self.lock_file)
+                    os.remove(self.lock_file)
+                time.sleep(0.01)
+
+    def unlock(self):
+        os.remove(self.lock_file)
+
+    def reserve(self, count=1) -> int:
+        """Reserve count consecutive indexes and return first of them"""
+        self.lock()
+        try:
+            with open(self.sequence_file) as f:
+                first = int(f.read().strip())
+            output.save_text_atomic(str(first + count), self.sequence_file)
+        finally:
+            self.unlock()
+        return first
+
+    def entry(self, file_index, attributes: list, records: list = None) -> dict:
+        """Return manifest line of item, records are image records of output.write_images (png and min.png without them)"""
+        images = ['%s.png' % file_index, '%s.min.png' % file_index] if records == None else [r['file'] for r in records]
+        return {
+            'index': file_index,
+            'files': images + ['%s.json' % file_index],
+            'traits': [[a['trait_type'], a['value']] for a in attributes],
+            'timestamp': time.time(),
+        }
+
+    def append(self, file_index, attributes: list, records: list = None):
+        line = json.dumps(self.entry(file_index, attributes, records)) + '\n'
+        with open(self.manifest_file, 'a') as f:
+            f.write(line)
+
+    def entries(self) -> list:
+        entries = []
+        with open(self.manifest_file) as f:
+            for line in f:
+                if line.strip() != '':
+                    entries.append(json.loads(line))
+        return entries
+
+    def json_files(self) -> list:
+        """Return item json paths, newest index first"""
+        entries = self.entries()
+        entries.sort(key=lambda e: e['index'], reverse=True)
+        return ['%s/%s' % (self.path, e['files'][-1]) for e in entries]
+
+    def rebuild(self):
+        """Regenerate manifest and sequence from json files of out folder"""
+        entries = []
+        for f in os.listdir(self.path):
+            name = f.split('.')[0]
+            if f.endswith('.json') and name.isdigit():
+                json_file = os.path.join(self.path, f)
+                with open(json_file) as item:
+                    info = json.load(item)
+                entry = self.entry(int(name), info['attributes'] if 'attributes' in info else [], info['variants'] if 'variants' in info else None)
+                entry['timestamp'] = os.stat(json_file).st_mtime
+                entries.append(entry)
+        entries.sort(key=lambda e: e['index'])
+        output.save_jsonl_atomic(entries, self.manifest_file)
+        output.save_text_atomic(str(entries[-1]['index'] + 1 if len(entries) > 0 else 1), self.sequence_file)
+        return len(entries)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Rebuild manifest and index sequence of out folder')
+    parser.add_argument('path', nargs='?', default=output.default_out_path)
+    args = parser.parse_args()
+    print('Manifest rebuilt with %d items' % Manifest(args.path, rebuild_missing=False).rebuild())
@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+from PIL import Image
+
+default_out_path = './out'
+
+# extra sizes written with every item: longest side in pixels, PIL format and save params,
+# palette=True maps variant to shared palette like .min.png
+default_variants = [
+    {'name': 'preview', 'size': 512, 'format': 'PNG', 'params': {'compress_level': 6}},
+    {'name': 'thumb', 'size': 128, 'format': 'PNG', 'params': {'optimize': True}, 'palette': True},
+]
+extensions = {'PNG': 'png', 'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def save_atomic(img: Image.Image, file, format='PNG', **params):
+    """Save image to temporary file and move it in place, so readers never see partial file"""
+    tmp_file = file + '.tmp'
+    img.save(tmp_file, format=format, **params)
+    os.replace(tmp_file, file)
+
+
+def save_text_atomic(text: str, file):
+    """Write text to temporary file and move it in place, like save_atomic"""
+    with open(file + '.tmp', 'w') as outfile:
+        outfile.write(text)
+    os.replace(file + '.tmp', file)
+
+
+def save_json_atomic(info: dict, file):
+    save_text_atomic(json.dumps(info), file)
+
+
+def save_jsonl_atomic(entries: list, file):
+    """Write entries as json lines, replacing file at once"""
+    save_text_atomic(''.join(json.dumps(entry) + '\n' for entry in entries), file)
+
+
+def file_hash(file, previous=None) -> dict:
+    """Return sha1, mtime and size of file, sha1 reused from previous entry when mtime and size unchanged"""
+    stat = os.stat(file)
+    if previous != None and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size:
+        return previous
+    with open(file, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return {'sha1': digest, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def item_digest(files, hashes) -> str:
+    """Return hash of layer files of item (paths and content), hashes maps file to file_hash"""
+    return hashlib.sha1(json.dumps([[f, hashes[f]['sha1']] for f in files]).encode('utf-8')).hexdigest()
+
+
+def files_digest(files, hashes: dict) -> str:
+    """Return item_digest of layer files, hashes is cache of file_hash updated in place"""
+    for file in files:
+        hashes[file] = file_hash(file, hashes.get(file))
+    return item_digest(files, hashes)
+
+
+def optimized(img: Image.Image, palette = None) -> Image.Image:
+    """Return image for .min.png: mapped to shared palette.Palette if provided, own palette otherwise"""
+    return img.convert('P') if palette == None else palette.quantize(img)
+
+
+def load_variants(file) -> list:
+    """Return variants from json file (list like default_variants), default_variants if file is None"""
+    if file == None:
+        return default_variants
+    with open(file) as json_file:
+        return json.load(json_file)
+
+
+def write_images(img: Image.Image, file_index, path = default_out_path, palette = None, variants = default_variants) -> list:
+    """
+    Write png, optimized png and resized variants of item, return their records for item json
+
+    Variants are downsampled successively from largest to smallest, each from previous one,
+    so composite is resized once per size and never decoded again.
+    """
+    save_atomic(img, '%s/%s.png' % (path, file_index))
+    save_atomic(optimized(img, palette), '%s/%s.min.png' % (path, file_index), optimize=True)
+    records = [
+        {'name': 'full', 'file': '%s.png' % file_index, 'width': img.width, 'height': img.height},
+        {'name': 'min', 'file': '%s.min.png' % file_index, 'width': img.width, 'height': img.height},
+    ]
+    current = img
+    for variant in sorted(variants, key=lambda v: -v['size']):
+        scale = min(1, variant['size'] / max(current.width, current.height))
+        if scale < 1:
+            current = current.resize((max(1, round(current.width * scale)), max(1, round(current.height * scale))), Image.LANCZOS, reducing_gap=2.0)
+        format = variant['format'] if 'format' in variant else 'PNG'
+        encoded = optimized(current, palette) if 'palette' in variant and variant['palette'] else current
+        if format == 'JPEG':
+            encoded = encoded.convert('RGB')
+        file = '%s.%s.%s' % (file_index, variant['name'], extensions[format])
+        save_atomic(encoded, '%s/%s' % (path, file), format, **(variant['params'] if 'params' in variant else {}))
+        records.append({'name': variant['name'], 'file': file, 'width': current.width, 'height': current.height})
+    return records
+
+
+def remove_item(file_index, records: list, path = default_out_path):
+    """Remove files of item written by write_item, records are its image records"""
+    for file in [r['file'] for r in records] + ['%s.json' % file_index]:
+        os.remove('%s/%s' % (path, file))
+
+
+def write_item(img: Image.Image, file_index, blueprint: dict, name_prefix, attributes: list, path = default_out_path, palette = None, variants = default_variants, layers_digest = None):
+    """
+    Write images (see write_images) and json built from blueprint template for item with given index,
+    optimized png mapped to shared palette.Palette of collection if provided. layers_digest (item_digest
+    of layer files item was composited from) is kept in json for rerender.py
+    """
+    records = write_images(img, file_index, path, palette, variants)
+
+    info = blueprint.copy()
+    info['name'] = "%s%s" % (name_prefix, file_index)
+    info['attributes'] = attributes
+    info['variants'] = records
+    if layers_digest != None:
+        info['layers_digest'] = layers_digest
+
+    save_json_atomic(info, '%s/%s.json' % (path, file_index))
+    return info
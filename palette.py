@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import numpy as np
+from PIL import Image
+from layers import decode_layer
+
+default_cache_path = './.cache'
+colors = 255
+transparent_index = 255
+lut_bits = 6
+sample_size = 256
+
+
+class Palette:
+    """
+    Shared palette of collection for .min.png output
+
+    lut maps every color (top lut_bits bits of each channel) to nearest palette index,
+    so quantizing an image is one table lookup per pixel. Pixels with alpha below 128
+    get transparent index. Palette of result is trimmed to colors image uses, with
+    transparent color first, so PNG palette and transparency chunks stay small.
+    """
+    colors: np.ndarray
+    lut: np.ndarray
+
+    def __init__(self, palette_colors: np.ndarray, lut: np.ndarray = None):
+        self.colors = palette_colors.astype(np.uint8)
+        self.lut = nearest_lut(self.colors) if lut is None else lut
+
+    def quantize(self, img: Image.Image) -> Image.Image:
+        arr = np.asarray(img.convert('RGBA'))
+        shift = 8 - lut_bits
+        indexes = self.lut[arr[..., 0] >> shift, arr[..., 1] >> shift, arr[..., 2] >> shift]
+        indexes[arr[..., 3] < 128] = transparent_index
+        used = np.flatnonzero(np.bincount(indexes.ravel(), minlength=256)[:len(self.colors)])
+        remap = np.zeros(256, dtype=np.uint8)
+        remap[used] = np.arange(1, len(used) + 1)
+        result = Image.fromarray(remap[indexes], 'P')
+        flat = np.zeros((len(used) + 1, 3), dtype=np.uint8)
+        flat[1:] = self.colors[used]
+        result.putpalette(flat.tobytes())
+        result.info['transparency'] = 0
+        return result
+
+
+def nearest_lut(palette_colors: np.ndarray) -> np.ndarray:
+    """Return table of nearest palette index for center of every lut cell"""
+    size = 1 << lut_bits
+    step = 1 << (8 - lut_bits)
+    levels = np.arange(size, dtype=np.float32) * step + step / 2
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+    palette_f = palette_colors.astype(np.float32)
+    palette_norm = (palette_f ** 2).sum(axis=1)
+    lut = np.empty(len(grid), dtype=np.uint8)
+    chunk = 8192
+    for start in range(0, len(grid), chunk):
+        part = grid[start:start + chunk]
+        distance = palette_norm[None, :] - 2 * part @ palette_f.T
+        lut[start:start + chunk] = distance.argmin(axis=1)
+    return lut.reshape(size, size, size)
+
+
+def layer_files(groups) -> list:
+    return sorted(set(file for group in groups for trait in group['traits'] for file in trait['file']))
+
+
+def files_key(files, svg_width, svg_height) -> str:
+    """Return key of caches built from layer files (palette, layerstore), changed when any file is modified"""
+    return hashlib.sha1(json.dumps([[f, os.stat(f).st_mtime_ns] for f in files] + [svg_width, svg_height]).encode('utf-8')).hexdigest()
+
+
+def build(files, svg_width, svg_height) -> Palette:
+    """Build palette from opaque pixels of downscaled layer files"""
+    samples = []
+    for file in files:
+        img = decode_layer(file, svg_width, svg_height)
+        img.thumbnail((sample_size, sample_size))
+        arr = np.asarray(img).reshape(-1, 4)
+        samples.append(arr[arr[:, 3] >= 128, :3])
+    pixels = np.concatenate(samples) if len(samples) > 0 else np.zeros((0, 3), dtype=np.uint8)
+    if len(pixels) == 0:
+        pixels = np.zeros((1, 3), dtype=np.uint8)
+    sample_img = Image.fromarray(pixels.reshape(-1, 1, 3), 'RGB')
+    quantized = sample_img.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+    used = int(np.asarray(quantized).max()) + 1
+    palette_colors = np.array(quantized.getpalette()[:used * 3], dtype=np.uint8).reshape(-1, 3)
+    return Palette(palette_colors)
+
+
+def load(groups, svg_width, svg_height, cache_path = default_cache_path) -> Palette:
+    """Return palette of layer files of groups, built once and cached until any layer file changes"""
+    files = layer_files(groups)
+    cache_file = os.path.join(cache_path, 'palette-%s.npz' % files_key(files, svg_width, svg_height))
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as cached:
+            return Palette(cached['colors'], cached['lut'])
+    palette = build(files, svg_width, svg_height)
+    os.makedirs(cache_path, exist_ok=True)
+    tmp_file = cache_file + '.tmp.npz'
+    np.savez(tmp_file, colors=palette.colors, lut=palette.lut)
+    os.replace(tmp_file, cache_file)
+    return palette
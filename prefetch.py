@@ -0,0 +1,87 @@
+import os
+import json
+import queue
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+
+class Prefetcher:
+    """
+    Loads items of out folder (json info and downscaled png) on worker thread
+
+    Loaded items kept in LRU cache bounded by memory, so navigation only hands
+    ready image to canvas. Only latest prefetch request is served, older ones dropped.
+    """
+    max_size: tuple
+    budget: int
+
+    def __init__(self, max_size=(1920, 1080), cache_mb=256):
+        self.max_size = max_size
+        self.budget = cache_mb * 1024 * 1024
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.generation = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def load(self, json_file) -> dict:
+        """Read item json and png downscaled to fit max_size"""
+        with open(json_file) as f:
+            info = json.load(f)
+        png_path = "%s.png" % json_file.rsplit('.', 1)[0]
+        img = None
+        if os.path.isfile(png_path):
+            with Image.open(png_path) as source:
+                img = source.copy()
+            img.thumbnail(self.max_size, Image.LANCZOS, reducing_gap=2.0)
+        return {'info': info, 'image': img, 'png_path': png_path}
+
+    def item_size(self, item) -> int:
+        img = item['image']
+        return 0 if img == None else img.width * img.height * len(img.getbands())
+
+    def put(self, json_file, item):
+        with self.lock:
+            if json_file in self.items:
+                return
+            self.items[json_file] = item
+            self.size += self.item_size(item)
+            while self.size > self.budget and len(self.items) > 1:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= self.item_size(evicted)
+
+    def cached(self, json_file):
+        with self.lock:
+            item = self.items.get(json_file)
+            if item != None:
+                self.items.move_to_end(json_file)
+            return item
+
+    def get(self, json_file) -> dict:
+        """Return prepared item, loaded on calling thread if it was not prefetched yet"""
+        item = self.cached(json_file)
+        if item == None:
+            item = self.load(json_file)
+            self.put(json_file, item)
+        return item
+
+    def prefetch(self, json_files: list):
+        """Replace pending requests with json_files, nearest first"""
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        for json_file in json_files:
+            self.requests.put((generation, json_file))
+
+    def run(self):
+        while True:
+            generation, json_file = self.requests.get()
+            if generation != self.generation or self.cached(json_file) != None:
+                continue
+            try:
+                self.put(json_file, self.load(json_file))
+            except Exception as exception:
+                print('Warning: prefetch of %s failed (%s)' % (json_file, exception))
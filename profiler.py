@@ -0,0 +1,102 @@
+import json
+import time
+import threading
+from collections import deque, OrderedDict
+from contextlib import nullcontext
+
+null_stage = nullcontext()
+
+
+class Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class Profiler:
+    """
+    Opt-in timers of hot stages with rolling percentiles
+
+    Disabled profiler returns shared no-op context from stage(), so wrapped code pays
+    one attribute check. Enabled one keeps last window durations per stage for
+    percentiles and last trace_size events, dumped as Chrome trace JSON
+    (chrome://tracing, Perfetto). With cprofile, cProfile runs too and is dumped as .prof.
+    Counters of caches are read from registered stats functions when shown or dumped.
+    """
+    window = 200
+    trace_size = 100000
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = OrderedDict()
+        self.events = deque(maxlen=self.trace_size)
+        self.origin = time.perf_counter_ns()
+        self.cprofile = None
+        self.counters = OrderedDict()
+
+    def enable(self, cprofile=False):
+        self.enabled = True
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stage(self, name):
+        return Stage(self, name) if self.enabled else null_stage
+
+    def add_counters(self, name, stats):
+        """Register function returning dict of counters (e.g. LayerCache.stats) shown with stages"""
+        self.counters[name] = stats
+
+    def record(self, name, start_ns, duration_ns):
+        samples = self.samples.get(name)
+        if samples == None:
+            samples = self.samples.setdefault(name, deque(maxlen=self.window))
+        samples.append(duration_ns)
+        self.events.append((name, start_ns, duration_ns, threading.get_ident()))
+
+    def percentiles(self, name) -> dict:
+        """Return count and p50 / p90 / p99 / max of last durations of stage in milliseconds"""
+        samples = sorted(self.samples.get(name, ()))
+        if len(samples) == 0:
+            return {'count': 0}
+        at = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] / 1e6
+        return {'count': len(samples), 'p50': at(0.5), 'p90': at(0.9), 'p99': at(0.99), 'max': samples[-1] / 1e6}
+
+    def report(self) -> dict:
+        return {name: self.percentiles(name) for name in list(self.samples)}
+
+    def summary(self) -> str:
+        """Return one line per stage for status overlay"""
+        lines = []
+        for name, p in self.report().items():
+            lines.append('%-14s p50 %7.1f  p90 %7.1f  max %7.1f ms' % (name, p['p50'], p['p90'], p['max']))
+        for name, stats in self.counters.items():
+            lines.append('%-14s %s' % (name, '  '.join('%s %s' % item for item in stats().items())))
+        return '\n'.join(lines)
+
+    def dump(self, prefix='profile'):
+        """Write percentiles and trace events to prefix.json, cProfile stats to prefix.prof"""
+        trace = [{
+            'name': name, 'ph': 'X', 'pid': 0, 'tid': tid,
+            'ts': (start - self.origin) / 1000, 'dur': duration / 1000,
+        } for name, start, duration, tid in list(self.events)]
+        with open(prefix + '.json', 'w') as f:
+            json.dump({'stages': self.report(), 'counters': {name: stats() for name, stats in self.counters.items()}, 'traceEvents': trace}, f)
+        files = [prefix + '.json']
+        if self.cprofile != None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(prefix + '.prof')
+            files.append(prefix + '.prof')
+        return files
+
+
+profiler = Profiler()
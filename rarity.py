@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import output
+from manifest import Manifest
+
+
+def read_attributes(json_file):
+    """Return (index, attributes) of item json file, None for unreadable or foreign files"""
+    name = os.path.basename(json_file).split('.')[0]
+    if not name.isdigit():
+        return None
+    try:
+        with open(json_file) as f:
+            info = json.load(f)
+    except (OSError, ValueError) as exception:
+        print('Warning: skipped %s in rarity stats (%s)' % (json_file, exception))
+        return None
+    return int(name), info['attributes'] if 'attributes' in info else []
+
+
+class RarityStats:
+    """
+    Trait frequencies of saved items, updated incrementally
+
+    Counters are keyed by (trait_type, value). Items are remembered by index, so adding
+    same item twice (saved while bulk build is running) counts it once. Rarity score of
+    item is sum of 1 / frequency of its traits, rank 1 is rarest item.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.items = {}
+        self.counts = Counter()
+        self.version = 0
+        self.ranking = None
+
+    def add(self, file_index, attributes: list):
+        traits = [(a['trait_type'], a['value']) for a in attributes]
+        with self.lock:
+            if file_index in self.items:
+                self.counts.subtract(self.items[file_index])
+            self.items[file_index] = traits
+            self.counts.update(traits)
+            self.version += 1
+
+    def build(self, path = output.default_out_path, workers=16) -> int:
+        """Count traits of all item json files of out folder, read by thread pool"""
+        try:
+            files = Manifest(path).json_files()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for item in executor.map(read_attributes, files):
+                    if item != None:
+                        self.add(*item)
+        finally:
+            self.ready.set()
+        return len(self.items)
+
+    def build_in_background(self, path = output.default_out_path, workers=16):
+        threading.Thread(target=self.build, args=(path, workers), daemon=True).start()
+
+    def frequency(self, trait_type, value) -> float:
+        with self.lock:
+            return self.counts[(trait_type, value)] / len(self.items) if len(self.items) > 0 else 0
+
+    def score(self, attributes: list) -> float:
+        with self.lock:
+            return self._score([(a['trait_type'], a['value']) for a in attributes])
+
+    def _score(self, traits) -> float:
+        total = len(self.items)
+        return sum(total / self.counts[t] for t in traits if self.counts[t] > 0)
+
+    def rank(self, file_index):
+        """Return rank of item by rarity score, 1 is rarest, None for unknown item"""
+        with self.lock:
+            if file_index not in self.items:
+                return None
+            if self.ranking == None or self.ranking[0] != self.version:
+                scores = sorted(((self._score(traits), indx) for indx, traits in self.items.items()), key=lambda s: -s[0])
+                self.ranking = (self.version, {indx: i + 1 for i, (_, indx) in enumerate(scores)})
+            return self.ranking[1][file_index]
+
+    def report(self) -> dict:
+        with self.lock:
+            total = len(self.items)
+            traits = {}
+            for (trait_type, value), count in self.counts.items():
+                if count > 0:
+                    traits.setdefault(trait_type, {})[value] = {'count': count, 'frequency': count / total}
+            return {'items': total, 'traits': traits}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Print trait frequencies and rarest items of out folder')
+    parser.add_argument('path', nargs='?', default=output.default_out_path)
+    parser.add_argument('--workers', help='Threads reading json files', default=16, type=int)
+    parser.add_argument('--top', help='Number of rarest items listed', default=10, type=int)
+    args = parser.parse_args()
+    stats = RarityStats()
+    stats.build(args.path, args.workers)
+    report = stats.report()
+    report['rarest'] = sorted(stats.items, key=stats.rank)[:args.top]
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import traits
+import output
+import duplicates
+import palette
+import generator
+from manifest import Manifest
+
+default_state_file = 'layers.json'
+
+
+def item_files(groups, attributes: list):
+    """Return layer files of item bottom up like editor composites them, None if traits file has no such item"""
+    titles = {a['trait_type']: a['value'] for a in attributes}
+    selected = set(titles.values())
+    files = []
+    for group in groups:
+        if group['group'] not in titles:
+            continue
+        trait = generator.resolve_variant(group, titles[group['group']], selected)
+        if trait == None:
+            return None
+        files += trait['file']
+    return files
+
+
+class LayerState:
+    """
+    Content hashes of layer files (reused while their mtime and size are same) and layer
+    digests of items which do not keep one
+
+    Stored in out folder. Item is stale when hash of its layers (paths and content)
+    differs from layers_digest written to its json when it was rendered, so edited layer
+    files and traits remapped to other files are both found. Items saved without it
+    (before digests were recorded) get digest of their current layers recorded here on
+    first run and are compared to it later.
+    """
+    def __init__(self, path = output.default_out_path, file = default_state_file):
+        self.file = os.path.join(path, file)
+        self.exists = os.path.isfile(self.file)
+        self.files = {}
+        self.items = {}
+        if self.exists:
+            with open(self.file) as f:
+                state = json.load(f)
+            self.files = state['files']
+            self.items = state['items']
+
+    def save(self):
+        tmp_file = self.file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'files': self.files, 'items': self.items}, f)
+        os.replace(tmp_file, self.file)
+
+
+def init_worker(out_path, svg_width, svg_height, cache_mb, shared_palette, variants):
+    generator.init_worker(None, None, out_path, svg_width, svg_height, cache_mb, shared_palette, variants)
+
+
+def read_item(out_path, file_index) -> dict:
+    with open('%s/%s.json' % (out_path, file_index)) as f:
+        return json.load(f)
+
+
+def rerender_item(job):
+    """Composite layers of item again and replace its images, only variants and layers_digest of json updated"""
+    file_index, files, layers_digest = job
+    state = generator.worker_state
+    img = generator.composite_files(files)
+    records = output.write_images(img, file_index, state['out_path'], state['palette'], state['variants'])
+    info = read_item(state['out_path'], file_index)
+    info['variants'] = records
+    info['layers_digest'] = layers_digest
+    output.save_json_atomic(info, '%s/%s.json' % (state['out_path'], file_index))
+    return file_index, duplicates.perceptual_hash(img)
+
+
+def rerender(groups, out_path = output.default_out_path, workers=None, svg_width=1080, svg_height=1080, cache_mb=512, dry_run=False, variants=output.default_variants, shared_palette=False) -> list:
+    """
+    Render again items of out folder whose layers changed since they were rendered, return their indexes
+
+    Lines of re-rendered items in duplicates index are replaced with hashes of new images.
+    """
+    state = LayerState(out_path)
+    items = []
+    for entry in Manifest(out_path).entries():
+        attributes = [{'trait_type': t, 'value': v} for t, v in entry['traits']]
+        files = item_files(groups, attributes)
+        if files == None:
+            print('Warning: traits of %s.png not found in traits file, skipped' % entry['index'])
+            continue
+        items.append((entry['index'], files, attributes))
+
+    hashes = {}
+    for file in sorted(set(f for _, files, _ in items for f in files)):
+        hashes[file] = output.file_hash(file, state.files.get(file))
+
+    stale = []
+    unrecorded = {}
+    for file_index, files, attributes in items:
+        digest = output.item_digest(files, hashes)
+        info = read_item(out_path, file_index)
+        if 'layers_digest' in info:
+            recorded = info['layers_digest']
+        else:
+            recorded = state.items.get(str(file_index), digest)
+            unrecorded[str(file_index)] = recorded
+        if recorded != digest:
+            stale.append((file_index, files, attributes, digest))
+    new_records = len(set(unrecorded) - set(state.items))
+    if new_records > 0:
+        print('Recorded layer hashes of %d items saved without them, next run re-renders them if their layers change' % new_records)
+    print('%d of %d items depend on changed layers' % (len(stale), len(items)))
+    if dry_run or len(stale) == 0:
+        if not dry_run:
+            state.files, state.items = hashes, unrecorded
+            state.save()
+        return [file_index for file_index, _, _, _ in stale]
+
+    start = time.perf_counter()
+    index = duplicates.DuplicateIndex(out_path)
+    attributes_of = {file_index: attributes for file_index, _, attributes, _ in stale}
+    svg_width, svg_height = generator.canvas_size(groups, svg_width, svg_height)
+    initargs = (out_path, svg_width, svg_height, cache_mb, palette.load(groups, svg_width, svg_height) if shared_palette else None, variants)
+    entries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+        jobs = [(file_index, files, digest) for file_index, files, _, digest in stale]
+        for done, (file_index, phash) in enumerate(executor.map(rerender_item, jobs, chunksize=max(1, min(64, len(jobs) // 64))), 1):
+            entries.append(index.entry(file_index, attributes_of[file_index], phash=phash))
+            unrecorded.pop(str(file_index), None)
+            if done % 100 == 0 or done == len(jobs):
+                print("Re-rendered %d/%d (%s.png)" % (done, len(jobs), file_index))
+    index.replace(entries)
+    state.files, state.items = hashes, unrecorded
+    state.save()
+    print("Done in %.1fs" % (time.perf_counter() - start))
+    return [file_index for file_index, _, _, _ in stale]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Render again items of out folder whose layer files changed')
+    parser.add_argument('traits_file', nargs='?', default='traits.json')
+    parser.add_argument('--path', help='Out folder', default=output.default_out_path)
+    parser.add_argument('--svg-width', default=1080, type=int)
+    parser.add_argument('--svg-height', default=1080, type=int)
+    parser.add_argument('--workers', help='Worker processes (default: cpu count)', default=None, type=int)
+    parser.add_argument('--layer-cache-mb', help='Memory budget in MB for decoded layers per worker', default=512, type=int)
+    parser.add_argument('--variants', help='JSON file with extra sizes, like app.py --variants', default=None)
+    parser.add_argument('--shared-palette', help='Map .min.png to one palette of all layer files, like app.py --shared-palette', action='store_true')
+    parser.add_argument('--dry-run', help='Only list items which would be rendered', action='store_true')
+    args = parser.parse_args()
+    stale = rerender(traits.load(args.traits_file, verbose=False), args.path, args.workers, args.svg_width, args.svg_height, args.layer_cache_mb, args.dry_run, output.load_variants(args.variants), args.shared_palette)
+    if args.dry_run:
+        print(json.dumps(stale))
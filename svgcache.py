@@ -0,0 +1,143 @@
+import os
+import hashlib
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from profiler import profiler
+
+default_cache_path = './.cache/svg'
+default_budget_mb = 2048
+
+
+class SvgCache:
+    """
+    On-disk cache of rendered svg layers
+
+    Rendered png is named by sha1 of svg content and output size, so every process
+    (editor, generator workers, tools) shares it and edited or renamed files never
+    get stale renders. Cache files are touched when read, and least recently used
+    ones are removed when total size exceeds budget.
+    """
+    budget: int
+
+    def __init__(self, path=default_cache_path, budget_mb=default_budget_mb):
+        self.path = path
+        self.budget = budget_mb * 1024 * 1024
+        self.hashes = {}
+
+    def content_hash(self, file) -> str:
+        """Return sha1 of file content, hashed again only when file changed"""
+        stat = os.stat(file)
+        key = (file, stat.st_mtime_ns, stat.st_size)
+        digest = self.hashes.get(key)
+        if digest == None:
+            with open(file, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            self.hashes[key] = digest
+        return digest
+
+    def cache_file(self, file, width, height) -> str:
+        return os.path.join(self.path, '%s-%sx%s.png' % (self.content_hash(file), width, height))
+
+    def render(self, file, width, height) -> bytes:
+        from cairosvg import svg2png  # imported on first svg, not needed for png only collections
+        with profiler.stage('svg_render'), open(file, 'rb') as svg_file:
+            return svg2png(file_obj=svg_file, unsafe=True, write_to=None, scale=1, output_width=width, output_height=height)
+
+    def get(self, file, width, height) -> Image.Image:
+        """Return rendered svg as RGBA image, rendered only when not cached"""
+        cache_file = self.cache_file(file, width, height)
+        try:
+            with open(cache_file, 'rb') as f:
+                data = f.read()
+            os.utime(cache_file)
+        except FileNotFoundError:
+            data = self.store(file, width, height)
+        return Image.open(BytesIO(data)).convert('RGBA')
+
+    def store(self, file, width, height, evict=True) -> bytes:
+        cache_file = self.cache_file(file, width, height)
+        data = self.render(file, width, height)
+        os.makedirs(self.path, exist_ok=True)
+        tmp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, cache_file)
+        if evict:
+            self.evict()
+        return data
+
+    def entries(self) -> list:
+        """Return (mtime, size, path) of cache files, oldest first"""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.png'):
+                file = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file))
+        entries.sort()
+        return entries
+
+    def evict(self) -> int:
+        """Remove least recently used files until cache fits budget, return number removed"""
+        entries = self.entries()
+        size = sum(e[1] for e in entries)
+        removed = 0
+        for _, file_size, file in entries:
+            if size <= self.budget:
+                break
+            try:
+                os.remove(file)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        return removed
+
+    def warm(self, files, width, height, workers=None) -> int:
+        """Render svg files missing in cache in process pool, return number rendered"""
+        missing = [f for f in sorted(set(files)) if f.endswith('.svg') and not os.path.isfile(self.cache_file(f, width, height))]
+        if len(missing) > 0:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(warm_file, [(self.path, f, width, height) for f in missing]):
+                    pass
+            self.evict()
+        return len(missing)
+
+    def stats(self) -> dict:
+        entries = self.entries() if os.path.isdir(self.path) else []
+        return {
+            'files': len(entries),
+            'size': sum(e[1] for e in entries),
+            'budget': self.budget,
+        }
+
+
+def warm_file(job):
+    path, file, width, height = job
+    SvgCache(path).store(file, width, height, evict=False)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import traits
+    import palette
+    import generator
+    parser = argparse.ArgumentParser(description='Render every svg layer of traits file into shared svg cache')
+    parser.add_argument('traits_file', nargs='?', default='traits.json')
+    parser.add_argument('--svg-width', help='Canvas width if bottom layer is svg, like app.py --svg-width', default=1080, type=int)
+    parser.add_argument('--svg-height', help='Canvas height if bottom layer is svg, like app.py --svg-height', default=1080, type=int)
+    parser.add_argument('--workers', help='Worker processes (default: cpu count)', default=None, type=int)
+    parser.add_argument('--budget-mb', help='Cache size limit in MB', default=default_budget_mb, type=int)
+    args = parser.parse_args()
+    cache = SvgCache(budget_mb=args.budget_mb)
+    groups = traits.load(args.traits_file, verbose=False)
+    # svg layers are rendered at size of bottom layer by editor and generator
+    svg_width, svg_height = generator.canvas_size(groups, args.svg_width, args.svg_height)
+    rendered = cache.warm(palette.layer_files(groups), svg_width, svg_height, args.workers)
+    print('Rendered %d svg files' % rendered)
+    print(json.dumps(cache.stats()))
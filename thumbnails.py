@@ -0,0 +1,95 @@
+import os
+import json
+import queue
+import threading
+from PIL import Image
+
+default_cache_path = './.cache/thumbs'
+variant_name = 'thumb'
+
+
+class ThumbnailCache:
+    """
+    Item thumbnails loaded on background thread
+
+    Items written with thumb variant (output.default_variants, listed in item json) use it,
+    downscaled only if it is larger than size. For other items thumbnail is made from png
+    and kept on disk, named by png name and size and rebuilt when png is newer.
+    Requests are served newest first, so thumbnails of rows scrolled away are
+    generated only after visible ones. Finished (png_path, image) pairs are put to
+    results queue, which GUI thread polls.
+    """
+    size: int
+
+    def __init__(self, size=160, path=default_cache_path):
+        self.size = size
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.requests = []
+        self.pending = set()
+        self.condition = threading.Condition()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def thumb_path(self, png_path) -> str:
+        name = os.path.basename(png_path).rsplit('.', 1)[0]
+        return os.path.join(self.path, '%s.%s.png' % (name, self.size))
+
+    def variant_path(self, png_path):
+        """Return path of thumb variant written with item, None if its json has none"""
+        json_path = '%s.json' % png_path.rsplit('.', 1)[0]
+        if not os.path.isfile(json_path):
+            return None
+        with open(json_path) as f:
+            info = json.load(f)
+        for record in info.get('variants', []):
+            if record['name'] == variant_name:
+                return os.path.join(os.path.dirname(png_path), record['file'])
+        return None
+
+    def load(self, png_path) -> Image.Image:
+        """Return thumb variant of item, or thumbnail from disk cache built and stored when missing or outdated"""
+        variant_path = self.variant_path(png_path)
+        if variant_path != None and os.path.isfile(variant_path):
+            with Image.open(variant_path) as variant:
+                # thumb variant may be mapped to palette
+                thumb = variant.convert('RGBA')
+            thumb.thumbnail((self.size, self.size), Image.LANCZOS, reducing_gap=2.0)
+            return thumb
+        thumb_path = self.thumb_path(png_path)
+        if os.path.isfile(thumb_path) and os.stat(thumb_path).st_mtime_ns >= os.stat(png_path).st_mtime_ns:
+            with Image.open(thumb_path) as thumb:
+                return thumb.copy()
+        with Image.open(png_path) as source:
+            source.thumbnail((self.size, self.size), Image.LANCZOS, reducing_gap=2.0)
+            thumb = source.copy()
+        tmp_path = thumb_path + '.tmp'
+        thumb.save(tmp_path, format='PNG')
+        os.replace(tmp_path, thumb_path)
+        return thumb
+
+    def request(self, png_path):
+        with self.condition:
+            if png_path in self.pending:
+                self.requests.remove(png_path)
+            self.pending.add(png_path)
+            self.requests.append(png_path)
+            self.condition.notify()
+
+    def cancel_all(self):
+        with self.condition:
+            self.requests.clear()
+            self.pending.clear()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.requests) == 0:
+                    self.condition.wait()
+                png_path = self.requests.pop()
+                self.pending.discard(png_path)
+            try:
+                self.results.put((png_path, self.load(png_path)))
+            except Exception as exception:
+                print('Warning: thumbnail of %s failed (%s)' % (png_path, exception))
@@ -1,15 +1,165 @@
 import os
 import json
+import hashlib
+from collections import Counter
 import healthcheck
 
-def is_real_file(file):
+default_snapshot_path = './.cache'
+snapshot_version = 1
+
+
+class TraitGroups(list):
+    """List of groups returned by load, with compiled constraint index"""
+    compiled: 'TraitIndex'
+    healthcheck: dict
+
+
+class TraitIndex:
+    """
+    Compiled lookups for exclude and adapted-to rules of loaded groups
+
+    Keeps title->groups map, counter of currently selected titles and precomputed
+    exclude and adapted-to sets per trait, so checks are set lookups instead of scans
+    over all groups. Selection must be changed with select() to keep counter in sync.
+    """
+    def __init__(self, groups):
+        self.title_groups = {}
+        self.exclude = {}
+        self.adapted = {}
+        self.adapted_variants = {}
+        self.selected = Counter()
+        for group in groups:
+            for trait in group['traits']:
+                self.title_groups.setdefault(trait['title'], []).append(group['group'])
+                self.exclude[id(trait)] = frozenset(trait['exclude']) if 'exclude' in trait else frozenset()
+                if 'adapted-to' in trait:
+                    self.adapted[id(trait)] = frozenset(trait['adapted-to'])
+                    self.adapted_variants.setdefault((group['group'], trait['title']), []).append(trait)
+        self.refresh(groups)
+
+    def refresh(self, groups):
+        """Recount selected titles from 'current' of groups"""
+        self.selected = Counter(group['current']['title'] for group in groups if 'current' in group)
+
+    def select(self, group, trait):
+        """Set trait as current of group and update selected titles"""
+        if 'current' in group:
+            title = group['current']['title']
+            self.selected[title] -= 1
+            if self.selected[title] <= 0:
+                del self.selected[title]
+        group['current'] = trait
+        self.selected[trait['title']] += 1
+
+    def check_condition(self, condition, selected=None):
+        selected = self.selected if selected is None else selected
+        return any(c in selected for c in condition)
+
+    def check_exclude(self, exclude, selected=None):
+        selected = self.selected if selected is None else selected
+        return any(c in selected for c in exclude)
+
+    def check_adapted_exists(self, current, group, selected=None):
+        selected = self.selected if selected is None else selected
+        current_adapted = current['adapted-to'] if 'adapted-to' in current else None
+        for trait in self.adapted_variants.get((group['group'], current['title']), []):
+            if current_adapted != trait['adapted-to']:
+                adapted = [a for a in trait['adapted-to'] if a in selected]
+                if len(adapted) > 0:
+                    return True, adapted
+        return False, None
+
+    def check_selection(self, groups, selected=None):
+        selected = self.selected if selected is None else selected
+        for group in groups:
+            if 'current' in group:
+                current = group['current']
+                if self.check_exclude(self.exclude[id(current)], selected):
+                    return False
+                if id(current) in self.adapted and not self.check_condition(self.adapted[id(current)], selected):
+                    return False
+                ok, adapted = self.check_adapted_exists(current, group, selected)
+                if ok:
+                    return False
+        return True
+
+
+def is_real_file(file, missing=None):
     if os.path.isfile(file):
         return True
     else:
         print("Warning: file %s is not a real path (this trait skipped)" % file)
+        if missing != None:
+            missing.append(file)
         return False
 
-def load(input_file):
+def referenced_files(file) -> list:
+    """Return all paths of 'file' value of trait in any of its forms"""
+    if isinstance(file, str):
+        return [file]
+    if isinstance(file, list):
+        return [f for item in file for f in referenced_files(item)]
+    if isinstance(file, dict) and 'path' in file:
+        return referenced_files(file['path'])
+    return []
+
+def snapshot_file(input_file, snapshot_path) -> str:
+    key = hashlib.sha1(os.path.abspath(input_file).encode('utf-8')).hexdigest()
+    return os.path.join(snapshot_path, 'traits-%s.json' % key)
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def write_snapshot(input_file, parsed, groups, missing, snapshot_path):
+    """
+    Store parsed groups with mtimes of traits file and of folders of all layer files:
+    adding, removing or renaming layer file changes mtime of its folder
+    """
+    folders = sorted(set(os.path.dirname(os.path.abspath(f)) for traits in parsed.values() for trait in traits.values() for f in referenced_files(trait['file'])))
+    snapshot = {
+        'version': snapshot_version,
+        'mtimes': [[path, mtime(path)] for path in [os.path.abspath(input_file)] + folders],
+        'groups': [{k: v for k, v in group.items() if k != 'current'} for group in groups],
+        'current': [group['traits'].index(group['current']) if 'current' in group else None for group in groups],
+        'missing': missing,
+        'healthcheck': groups.healthcheck,
+    }
+    try:
+        os.makedirs(snapshot_path, exist_ok=True)
+        file = snapshot_file(input_file, snapshot_path)
+        with open(file + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(file + '.tmp', file)
+    except OSError as exception:
+        print('Warning: traits snapshot not written (%s)' % exception)
+
+def load_snapshot(input_file, verbose, snapshot_path):
+    """Return groups from snapshot of input_file, None when missing or outdated"""
+    try:
+        with open(snapshot_file(input_file, snapshot_path)) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('version') != snapshot_version or any(mtime(path) != value for path, value in snapshot['mtimes']):
+        return None
+    for file in snapshot['missing']:
+        print("Warning: file %s is not a real path (this trait skipped)" % file)
+    if verbose:
+        for findings in snapshot['healthcheck'].values():
+            for finding in findings:
+                print(finding['message'])
+    groups = TraitGroups(snapshot['groups'])
+    for group, current in zip(groups, snapshot['current']):
+        if current != None:
+            group['current'] = group['traits'][current]
+    groups.healthcheck = snapshot['healthcheck']
+    groups.compiled = TraitIndex(groups)
+    return groups
+
+def load(input_file, verbose=True, snapshot_path=default_snapshot_path):
     """
     Load traits json file and return list of groups like:
     [
@@ -18,6 +168,7 @@ def load(input_file):
             traits: [
                 {
                     title: 'Head 1',
+                    weight: 1,
                     file: ['/1.png', '2.png'],
                     condition: ['Body1'],
                     excluded: ['Leg 3']
@@ -27,9 +178,19 @@ def load(input_file):
         },
         ...
     ]
-    Where current represent traits[0] by default
+    Where current represent traits[0] by default.
+    Returned list also has compiled TraitIndex used by check_* functions,
+    change current trait with select() to keep it valid, and healthcheck report
+    (notices printed if verbose).
+    Parsed groups are kept in snapshot in snapshot_path and reused while traits file
+    and folders of layer files are unchanged (None disables snapshot).
     """
-    groups = []
+    if snapshot_path != None:
+        groups = load_snapshot(input_file, verbose, snapshot_path)
+        if groups != None:
+            return groups
+    groups = TraitGroups()
+    missing = []
     with open(input_file) as json_file:
         try:
             parsed = json.load(json_file)
@@ -39,16 +200,16 @@ def load(input_file):
                     file = trait['file']
                     paths = []
                     #single file as string
-                    if isinstance(file, str) and is_real_file(file) == True: 
+                    if isinstance(file, str) and is_real_file(file, missing) == True: 
                         paths.append({'title': trait_name, 'file': [file]})
                     #more then 1 file in array style of strings
-                    elif isinstance(file, list) and all(isinstance(f, str) and is_real_file(f) for f in file): 
+                    elif isinstance(file, list) and all(isinstance(f, str) and is_real_file(f, missing) for f in file): 
                         paths.append({'title': trait_name, 'file': file})
                     #single file in dict style with path as string without condition
                     elif isinstance(file, dict) and 'path' in file and isinstance(file['path'], str) and 'adapted-to' not in file: 
                         paths.append({'title': trait_name, 'file': [file['path']]})
                     #single file in dict style with path as array of strings without condition
-                    elif isinstance(file, dict) and 'path' in file and isinstance(file['path'], list) and all(isinstance(f, str) and is_real_file(f) for f in file['path']) and 'adapted-to' not in file:
+                    elif isinstance(file, dict) and 'path' in file and isinstance(file['path'], list) and all(isinstance(f, str) and is_real_file(f, missing) for f in file['path']) and 'adapted-to' not in file:
                         paths.append({'title': trait_name, 'file': file['path']})
                     #single file in dict style with path as string with condition
                     elif isinstance(file, dict) and 'path' in file and isinstance(file['path'],str) and 'adapted-to' in file:
@@ -59,13 +220,13 @@ def load(input_file):
                     elif isinstance(file, list):
                         has_default = False
                         for t_file in file:
-                            if isinstance(t_file, str) and is_real_file(t_file):
+                            if isinstance(t_file, str) and is_real_file(t_file, missing):
                                 if has_default == False:
                                     paths.append({'title': trait_name, 'file': [t_file]})
                                     has_default = True
                                 else:
                                     print('Warning: more then 1 default path for trait %s, %s ignored' % (trait_name,t_file))
-                            if isinstance(t_file, list) and all(isinstance(f, str) and is_real_file(f) for f in t_file):
+                            if isinstance(t_file, list) and all(isinstance(f, str) and is_real_file(f, missing) for f in t_file):
                                 if has_default == False:
                                     paths.append({'title': trait_name, 'file': t_file})
                                     has_default = True
@@ -85,6 +246,7 @@ def load(input_file):
                                         paths.append({'title': trait_name, 'file': t_file['path']})
                                         has_default = True
                     for path in paths:
+                        path['weight'] = trait['weight'] if 'weight' in trait else 1
                         if 'exclude' in trait and isinstance(trait['exclude'], str):
                             path['exclude'] = [trait['exclude']]
                         elif 'exclude' in trait and isinstance(trait['exclude'], list):
@@ -93,15 +255,30 @@ def load(input_file):
                         if 'current' not in group:
                             group['current'] = path
                 groups.append(group)
-            healthcheck.same_trait_name(groups)
-            healthcheck.adapted_for_unknown(groups)
-            healthcheck.excluded_for_unknown(groups)
+            groups.healthcheck = healthcheck.run(groups, verbose)
+            groups.compiled = TraitIndex(groups)
+            if snapshot_path != None:
+                write_snapshot(input_file, parsed, groups, missing, snapshot_path)
             return groups
         except Exception as exception:
             print('Error in parsing layers from traits file (%s)' % input_file)
             print(exception)
 
+def compiled_index(groups):
+    return groups.compiled if isinstance(groups, TraitGroups) and hasattr(groups, 'compiled') else None
+
+def select(groups, group, trait):
+    """Set trait as current of group, keeping compiled index of groups in sync"""
+    index = compiled_index(groups)
+    if index != None:
+        index.select(group, trait)
+    else:
+        group['current'] = trait
+
 def check_condition(condition, groups):
+    index = compiled_index(groups)
+    if index != None:
+        return index.check_condition(condition)
     for trait in groups:
         for c in condition:
             if 'current' in trait and c == trait['current']['title']:
@@ -109,6 +286,9 @@ def check_condition(condition, groups):
     return False
 
 def check_exclude(exclude, groups):
+    index = compiled_index(groups)
+    if index != None:
+        return index.check_exclude(exclude)
     for trait in groups:
         for c in exclude:
             if 'current' in trait and c == trait['current']['title']:
@@ -116,6 +296,9 @@ def check_exclude(exclude, groups):
     return False
 
 def check_adapted_exists(current, group, groups):
+    index = compiled_index(groups)
+    if index != None:
+        return index.check_adapted_exists(current, group)
     matched = False
 
     for trait in group['traits']:
@@ -131,3 +314,20 @@ def check_adapted_exists(current, group, groups):
         if matched == True:
             return matched, adapted
     return False, None
+
+def check_selection(groups):
+    """Return True if current traits of all groups can be saved: nothing excluded, all adapted-to satisfied and no adapted variant missed"""
+    index = compiled_index(groups)
+    if index != None:
+        return index.check_selection(groups)
+    for trait in groups:
+        if 'current' in trait:
+            current = trait['current']
+            if 'exclude' in current and check_exclude(current['exclude'], groups):
+                return False
+            if 'adapted-to' in current and not check_condition(current['adapted-to'], groups):
+                return False
+            ok, adapted = check_adapted_exists(current, trait, groups)
+            if ok:
+                return False
+    return True
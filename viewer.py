@@ -3,8 +3,11 @@ from tkinter import ttk
 import os
 import widget.image_viewer as image_viewer
 import widget.vscroll_frame as vscroll_frame
-import json
+import widget.thumbnail_gallery as thumbnail_gallery
 from PIL import Image
+from prefetch import Prefetcher
+from manifest import Manifest
+from rarity import RarityStats
 
 default_out_path = './out'
 
@@ -12,11 +15,20 @@ class Viewer(tk.Tk):
     current_file_name = None
     current_file_indx = None
     file_list = []
+    rarity_poll_ms = 200
 
-    def __init__(self, **kwargs):
+    def __init__(self, prefetch_window=2, prefetch_cache_mb=256, rarity=None, **kwargs):
         tk.Tk.__init__(self, **kwargs)
 
         self.load_file_list()
+        if rarity == None:
+            rarity = RarityStats()
+            rarity.build_in_background()
+        self.rarity = rarity
+        self.rarity_poll = None
+        self.shown_attributes = None
+        self.prefetch_window = prefetch_window
+        self.prefetcher = Prefetcher(max_size=(self.winfo_screenwidth(), self.winfo_screenheight()), cache_mb=prefetch_cache_mb)
 
         self.title("NFT Viewer")
         self.minsize(900,600)
@@ -30,6 +42,7 @@ class Viewer(tk.Tk):
         self.nft_info.grid(column=1, row=0, sticky='nwse')
         self.nft_info.inner.columnconfigure(0, weight=1)
         self.nft_info.inner.columnconfigure(1, weight=1)
+        self.nft_info.inner.columnconfigure(2, weight=0)
 
         self.nav_frame = tk.Frame(self, pady=10)
         self.nav_frame.grid(column=1, row=2, sticky='ew')
@@ -42,11 +55,34 @@ class Viewer(tk.Tk):
         self.next_button = tk.Button(self.nav_frame, text='Next', state='disabled', command=lambda: self.show_next_item())
         self.next_button.grid(column=1, row=0, sticky='ew')
         self.has_next_item()
+
+        self.gallery = None
+        self.gallery_button = tk.Button(self.nav_frame, text='Gallery', command=lambda: self.toggle_gallery())
+        self.gallery_button.grid(column=0, row=1, columnspan=2, sticky='ew', pady=(5,0))
+
+    def toggle_gallery(self):
+        """Switch between single item view and thumbnails grid, created on first use"""
+        if self.gallery == None:
+            self.gallery = thumbnail_gallery.ThumbnailGallery(self, on_select=self.on_gallery_select, highlightthickness=1, borderwidth=1, relief="groove")
+            self.gallery.set_items([(os.path.basename(f).rsplit('.', 1)[0], "%s.png" % f.rsplit('.', 1)[0]) for f in self.file_list])
+        if self.gallery.winfo_ismapped():
+            self.gallery.grid_remove()
+            self.nft_viewer.grid()
+            self.gallery_button.configure(text='Gallery')
+        else:
+            self.nft_viewer.grid_remove()
+            self.gallery.grid(column=0, row=0, sticky='nwse')
+            self.gallery_button.configure(text='Item')
+
+    def on_gallery_select(self, indx):
+        self.current_file_indx = indx
+        self.show_item(indx)
+        self.has_next_item()
+        self.has_prev_item()
+        self.toggle_gallery()
         
     def load_file_list(self, path = default_out_path):
-        files = [f.split('.')[0] for f in os.listdir(path) if f.endswith('.json')]
-        files.sort(key=lambda x: int(x) if x.isdigit() else -1, reverse=True)
-        self.file_list = list(map(lambda f: "%s/%s.json" % (path, f), files))
+        self.file_list = Manifest(path).json_files()
         if len(self.file_list) > 0:
             self.current_file_name = self.file_list[0]
             self.current_file_indx = 0
@@ -71,15 +107,23 @@ class Viewer(tk.Tk):
 
     def show_item(self, indx):
         json_file = self.file_list[indx]
-        with open(json_file) as f:
-            info = json.load(f)
-            if 'name' in info:
-                png_path = "%s.png" % json_file.rsplit('.', 1)[0]
-                if os.path.isfile(png_path):
-                    img = Image.open(png_path)
-                    self.nft_viewer.set_image(img)
-            if 'attributes' in info:
-                self.load_item_attributes(info, png_path)
+        item = self.prefetcher.get(json_file)
+        info = item['info']
+        png_path = item['png_path']
+        if 'name' in info and item['image'] != None:
+            self.nft_viewer.set_image(item['image'], full_image=lambda: Image.open(png_path))
+        if 'attributes' in info:
+            self.load_item_attributes(info, png_path)
+        self.prefetch_neighbours(indx)
+
+    def prefetch_neighbours(self, indx):
+        """Ask prefetcher for items around indx, nearest first"""
+        files = []
+        for step in range(1, self.prefetch_window + 1):
+            for i in (indx + step, indx - step):
+                if 0 <= i < len(self.file_list):
+                    files.append(self.file_list[i])
+        self.prefetcher.prefetch(files)
 
     def has_next_item(self):
         if self.current_file_indx is None:
@@ -114,24 +158,51 @@ class Viewer(tk.Tk):
         self.has_prev_item()
         self.has_next_item()
 
+    def poll_rarity(self):
+        """Show rarity of current item once stats are built, checked every rarity_poll_ms"""
+        if not self.rarity.ready.is_set():
+            self.rarity_poll = self.after(self.rarity_poll_ms, self.poll_rarity)
+            return
+        self.rarity_poll = None
+        if self.shown_attributes != None:
+            self.load_item_attributes(*self.shown_attributes)
+
     def load_item_attributes(self, info, filename):  
+        self.shown_attributes = (info, filename)
+        ready = self.rarity.ready.is_set()
+        if not ready and self.rarity_poll == None:
+            self.rarity_poll = self.after(self.rarity_poll_ms, self.poll_rarity)
         for widget in self.nft_info.inner.winfo_children():
             widget.destroy()
         # Name
         label = tk.Label(self.nft_info, text=info['name'], anchor='center', font=('system', 12, 'bold'))
-        label.grid(column=0, row=0, sticky='ew', columnspan=2, pady=(0,10))
+        label.grid(column=0, row=0, sticky='ew', columnspan=3, pady=(0,10))
         # filename
         label = tk.Label(self.nft_info, text='(%s)' % filename, anchor='center', font=('system', 12, 'bold'))
-        label.grid(column=0, row=1, sticky='ew', columnspan=2, pady=(0,10))
+        label.grid(column=0, row=1, sticky='ew', columnspan=3, pady=(0,10))
         if 'attributes' in info and isinstance(info['attributes'], list):
-            row = 2
+            # rarity
+            name = os.path.basename(filename).split('.')[0]
+            if ready:
+                rank = self.rarity.rank(int(name)) if name.isdigit() else None
+                text = 'Rarity score %.1f' % self.rarity.score(info['attributes'])
+                if rank != None:
+                    text += ' (#%d of %d)' % (rank, len(self.rarity.items))
+            else:
+                text = 'Rarity: loading...'
+            label = tk.Label(self.nft_info, text=text, anchor='center', font=('system', 12))
+            label.grid(column=0, row=2, sticky='ew', columnspan=3, pady=(0,10))
+            row = 3
             for a in info['attributes']:
                 label = tk.Label(self.nft_info, text=a['trait_type'], anchor='w', font=('system', 12, 'bold'))
                 label.grid(column=0, row=row, sticky='ew')
                 label = tk.Label(self.nft_info, text=a['value'], anchor='w', font=('system', 12))
                 label.grid(column=1, row=row, sticky='ew')
+                frequency = '%.1f%%' % (self.rarity.frequency(a['trait_type'], a['value']) * 100) if ready else '...'
+                label = tk.Label(self.nft_info, text=frequency, anchor='e', font=('system', 12))
+                label.grid(column=2, row=row, sticky='ew')
                 row+=1
                 sep = ttk.Separator(self.nft_info)
-                sep.grid(column=0, row=row, columnspan=2, sticky='ew', pady=(0,10))
+                sep.grid(column=0, row=row, columnspan=3, sticky='ew', pady=(0,10))
                 row+=1
 
@@ -1,7 +1,19 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter.constants import NO
-from PIL import Image, ImageTk
+from PIL import Image
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from profiler import profiler
+
+if TYPE_CHECKING:
+    from PIL import ImageTk
+
+
+def photo_image(img: Image.Image, master) -> 'ImageTk.PhotoImage':
+    """Return Tk photo of image, ImageTk imported on first use"""
+    from PIL import ImageTk
+    return ImageTk.PhotoImage(img, master=master)
 
 
 class ImageViewer(tk.Frame):
@@ -9,10 +21,17 @@ class ImageViewer(tk.Frame):
     Viewer provide Frame with Canvas, ScrollBars and Options to display Images
     """
     source_image: Image.Image
-    source_photo_image: ImageTk.PhotoImage
+    source_photo_image: 'ImageTk.PhotoImage'
+    full_image = None
+    draft_ms = 30
+    settle_ms = 150
+    photo_cache_size = 8
 
     def __init__(self, master, **kwargs):
         tk.Frame.__init__(self, master=master, **kwargs)
+        self.photo_cache = OrderedDict()
+        self.draft_job = None
+        self.settle_job = None
 
         self.canvas = tk.Canvas(self)
         self.canvas.bind('<Configure>', lambda e: self.on_canvas_resize(e))
@@ -37,17 +56,58 @@ class ImageViewer(tk.Frame):
         self.rowconfigure(2, weight=1)
 
     
-    def set_image(self, img: Image.Image):
+    def set_image(self, img: Image.Image, full_image=None):
+        """
+        Show image, full_image is optional callable returning full resolution
+        image when img is downscaled preview, it is used once fit option disabled
+        """
         self.source_image = img
+        self.full_image = full_image
+        self.photo_cache.clear()
         self.canvas_image_resize()
     
     def on_cb_fit_image_changed(self):
         self.canvas_image_resize()
 
     def on_canvas_resize(self, event):
+        """
+        Configure events coalesced: draft quality image shown at most once per
+        draft_ms while resizing, high quality one rendered when size settled
+        """
+        if self.draft_job == None:
+            self.draft_job = self.after(self.draft_ms, self.on_draft_resize)
+        if self.settle_job != None:
+            self.after_cancel(self.settle_job)
+        self.settle_job = self.after(self.settle_ms, self.on_settled_resize)
+
+    def on_draft_resize(self):
+        self.draft_job = None
+        self.canvas_image_resize(draft=True)
+
+    def on_settled_resize(self):
+        self.settle_job = None
         self.canvas_image_resize()
 
-    def canvas_image_resize(self):
+    def fitted_photo_image(self, width, height, draft=False) -> 'ImageTk.PhotoImage':
+        """Return PhotoImage of source image resized to width x height, cached per size and quality"""
+        key = (width, height, draft)
+        photo = self.photo_cache.get(key)
+        if photo != None:
+            self.photo_cache.move_to_end(key)
+            return photo
+        with profiler.stage('resize'):
+            if draft:
+                fit_img = self.source_image.resize((width, height), Image.NEAREST)
+            else:
+                fit_img = self.source_image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        with profiler.stage('photo_image'):
+            photo = photo_image(fit_img, self)
+        self.photo_cache[key] = photo
+        while len(self.photo_cache) > self.photo_cache_size:
+            self.photo_cache.popitem(last=False)
+        return photo
+
+    def canvas_image_resize(self, draft=False):
         """
         Resize image inside canvas based on screen size or fit option
         """ 
@@ -69,26 +129,35 @@ class ImageViewer(tk.Frame):
         ratio = ratio_w if ratio_w < ratio_h else ratio_h
 
         if self.canvas_fit_image.get() == True:
-            img_width = int(ratio * img_width)
-            img_height = int(ratio * img_height)
-            fit_img = self.source_image.resize((img_width, img_height))
-            self.source_photo_image = ImageTk.PhotoImage(fit_img, master=self)
+            img_width = max(1, int(ratio * img_width))
+            img_height = max(1, int(ratio * img_height))
+            self.source_photo_image = self.fitted_photo_image(img_width, img_height, draft)
             self.canvas.delete('source_img')
             self.canvas.create_image(canvas_width/2,canvas_height/2, image=self.source_photo_image, tag='source_img')
             self.canvas.configure(scrollregion=[0, 0, canvas_width, canvas_height])
             self.scroll_x.grid_remove()
             self.scroll_y.grid_remove()
         else:
-            self.source_photo_image = ImageTk.PhotoImage(self.source_image, master=self)
+            if self.full_image != None:
+                self.source_image = self.full_image()
+                self.full_image = None
+                self.photo_cache.clear()
+                img_width, img_height = self.source_image.size
+            self.source_photo_image = self.photo_cache.get('full')
+            if self.source_photo_image == None:
+                with profiler.stage('photo_image'):
+                    self.source_photo_image = photo_image(self.source_image, self)
+                self.photo_cache['full'] = self.source_photo_image
             x = 0
             y = 0
             if canvas_width>img_width:
                 x = (canvas_width - img_width) / 2
             if canvas_height>img_height:
                 y = (canvas_height - img_height) /2
+            self.canvas.delete('source_img')
             self.canvas.create_image(x,y, image=self.source_photo_image, tag='source_img')
             self.canvas.configure(scrollregion=[-img_width/2,-img_height/2,img_width/2, img_height/2])
             self.canvas.yview_moveto('0')
             self.canvas.xview_moveto('0')
             self.scroll_x.grid(row=3,column=0, sticky='ew')
-            self.scroll_y.grid(row=2,column=1, sticky='ns')
\ No newline at end of file
+            self.scroll_y.grid(row=2,column=1, sticky='ns')
@@ -0,0 +1,151 @@
+import tkinter as tk
+from collections import OrderedDict
+from thumbnails import ThumbnailCache
+from widget.image_viewer import photo_image
+
+
+class ThumbnailGallery(tk.Frame):
+    """
+    Scrollable grid of item thumbnails
+
+    Only visible rows have canvas items: cells scrolled out are reused for new rows.
+    Thumbnails (thumb variant of item, own cached one for items without it) loaded by
+    ThumbnailCache in background, only PhotoImages of last
+    shown cells kept in memory.
+    """
+    cell_padding = 10
+    label_height = 20
+    poll_ms = 50
+
+    def __init__(self, master, thumb_size=160, max_photos=500, on_select=None, **kwargs):
+        tk.Frame.__init__(self, master=master, **kwargs)
+        self.thumbs = ThumbnailCache(size=thumb_size)
+        self.cell_width = thumb_size + self.cell_padding
+        self.cell_height = thumb_size + self.label_height + self.cell_padding
+        self.max_photos = max_photos
+        self.on_select = on_select
+        self.items = []
+        self.columns = 1
+        self.photos = OrderedDict()
+        self.cells = {}
+        self.free_cells = []
+
+        self.canvas = tk.Canvas(self, highlightthickness=0, yscrollincrement=self.label_height)
+        self.scroll_y = tk.Scrollbar(self, orient="vertical", command=self.on_scroll)
+        self.canvas.configure(yscrollcommand=self.scroll_y.set)
+        self.canvas.grid(row=0, column=0, sticky='nwse')
+        self.scroll_y.grid(row=0, column=1, sticky='ns')
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.canvas.bind('<Configure>', lambda e: self.refresh())
+        self.canvas.bind('<Enter>', self._bind_mouse)
+        self.canvas.bind('<Leave>', self._unbind_mouse)
+        self.canvas.tag_bind('cell', '<Button-1>', self.on_click)
+        self.after(self.poll_ms, self.poll_thumbnails)
+
+    def set_items(self, items: list):
+        """Show items, list of (title, png_path)"""
+        self.items = items
+        for cell in self.cells.values():
+            self.hide_cell(cell)
+            self.free_cells.append(cell)
+        self.cells = {}
+        self.canvas.yview_moveto(0)
+        self.refresh()
+
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def visible_range(self) -> range:
+        height = self.canvas.winfo_height()
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // self.cell_height))
+        last_row = int((top + height) // self.cell_height) + 1
+        return range(first_row * self.columns, min(len(self.items), last_row * self.columns))
+
+    def refresh(self):
+        """Place cells for visible items, reusing cells of items scrolled out"""
+        width = self.canvas.winfo_width()
+        self.columns = max(1, width // self.cell_width)
+        rows = (len(self.items) + self.columns - 1) // self.columns
+        self.canvas.configure(scrollregion=(0, 0, self.columns * self.cell_width, rows * self.cell_height))
+
+        visible = self.visible_range()
+        for indx in [i for i in self.cells if i not in visible]:
+            cell = self.cells.pop(indx)
+            self.hide_cell(cell)
+            self.free_cells.append(cell)
+
+        self.thumbs.cancel_all()
+        for indx in visible:
+            if indx not in self.cells:
+                self.cells[indx] = self.free_cells.pop() if len(self.free_cells) > 0 else self.create_cell()
+            self.show_cell(self.cells[indx], indx)
+
+    def create_cell(self) -> dict:
+        image = self.canvas.create_image(0, 0, anchor='n', tags=('cell',))
+        text = self.canvas.create_text(0, 0, anchor='n', font=('system', 10), tags=('cell',))
+        return {'image': image, 'text': text, 'indx': None}
+
+    def hide_cell(self, cell):
+        cell['indx'] = None
+        self.canvas.itemconfigure(cell['image'], state='hidden')
+        self.canvas.itemconfigure(cell['text'], state='hidden')
+
+    def show_cell(self, cell, indx):
+        title, png_path = self.items[indx]
+        x = (indx % self.columns) * self.cell_width + self.cell_width / 2
+        y = (indx // self.columns) * self.cell_height + self.cell_padding / 2
+        self.canvas.coords(cell['image'], x, y)
+        self.canvas.coords(cell['text'], x, y + self.thumbs.size)
+        if cell['indx'] != indx:
+            cell['indx'] = indx
+            self.canvas.itemconfigure(cell['text'], text=title, state='normal')
+            photo = self.photos.get(png_path)
+            if photo != None:
+                self.photos.move_to_end(png_path)
+                self.canvas.itemconfigure(cell['image'], image=photo, state='normal')
+            else:
+                self.canvas.itemconfigure(cell['image'], image='', state='hidden')
+        if png_path not in self.photos:
+            self.thumbs.request(png_path)
+
+    def poll_thumbnails(self):
+        """Turn thumbnails finished in background into PhotoImages of visible cells"""
+        while not self.thumbs.results.empty():
+            png_path, img = self.thumbs.results.get()
+            photo = photo_image(img, self)
+            self.photos[png_path] = photo
+            while len(self.photos) > self.max_photos:
+                self.photos.popitem(last=False)
+            for indx, cell in self.cells.items():
+                if self.items[indx][1] == png_path:
+                    self.canvas.itemconfigure(cell['image'], image=photo, state='normal')
+        self.after(self.poll_ms, self.poll_thumbnails)
+
+    def on_click(self, event):
+        current = self.canvas.find_withtag('current')
+        for indx, cell in self.cells.items():
+            if len(current) > 0 and current[0] in (cell['image'], cell['text']):
+                if self.on_select != None:
+                    self.on_select(indx)
+                return
+
+    def _bind_mouse(self, event=None):
+        self.canvas.bind_all("<4>", self._on_mousewheel)
+        self.canvas.bind_all("<5>", self._on_mousewheel)
+        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
+
+    def _unbind_mouse(self, event=None):
+        self.canvas.unbind_all("<4>")
+        self.canvas.unbind_all("<5>")
+        self.canvas.unbind_all("<MouseWheel>")
+
+    def _on_mousewheel(self, event):
+        """Linux uses event.num; Windows / Mac uses event.delta"""
+        if event.num == 4 or event.delta > 0:
+            self.on_scroll('scroll', -1, 'units')
+        elif event.num == 5 or event.delta < 0:
+            self.on_scroll('scroll', 1, 'units')
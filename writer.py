@@ -0,0 +1,99 @@
+import queue
+import threading
+import time
+import output
+import duplicates
+
+
+class SaveQueue:
+    """
+    Background writer of saved items
+
+    Items are encoded and written one by one on writer thread, in order of submit.
+    Index must be reserved by caller before submit. Completion callbacks are not
+    called from writer thread: poll() runs them on the thread which calls it (Tk main loop).
+    palette_loader is called on writer thread before first item to get shared palette.
+    Digest of layer files of item (output.files_digest) is computed on writer thread too.
+    With index (duplicates.DuplicateIndex) image hashes are computed on writer thread,
+    item with same image as saved one is not written (error is duplicates.DuplicateItem)
+    and written items are added to index before next item is checked.
+    """
+    def __init__(self, path = output.default_out_path, palette_loader = None, variants = output.default_variants, index = None):
+        self.path = path
+        self.index = index
+        self.variants = variants
+        self.palette_loader = palette_loader
+        self.palette = None
+        self.layer_hashes = {}
+        self.jobs = queue.Queue()
+        self.done = queue.Queue()
+        self.saved = 0
+        self.failed = 0
+        self.last_encode_seconds = 0.0
+        self.total_encode_seconds = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, img, file_index, blueprint: dict, name_prefix, attributes: list, layer_files: list, on_done=None):
+        """Queue item composited from layer_files, on_done(file_index, records, error) called from poll() after it is written or refused,
+        records are image records of output.write_images (None if item not written)
+        """
+        self.jobs.put((img, file_index, blueprint.copy(), name_prefix, attributes, layer_files, on_done))
+
+    def depth(self) -> int:
+        """Items queued or being written"""
+        return self.jobs.unfinished_tasks
+
+    def run(self):
+        while True:
+            img, file_index, blueprint, name_prefix, attributes, layer_files, on_done = self.jobs.get()
+            start = time.perf_counter()
+            error = None
+            records = None
+            try:
+                if self.index != None:
+                    phash = duplicates.perceptual_hash(img)
+                    found = self.index.find(attributes, phash=phash)
+                    if found != None:
+                        raise duplicates.DuplicateItem(*found)
+                if self.palette == None and self.palette_loader != None:
+                    self.palette = self.palette_loader()
+                layers_digest = output.files_digest(layer_files, self.layer_hashes)
+                records = output.write_item(img, file_index, blueprint, name_prefix, attributes, self.path, self.palette, self.variants, layers_digest)['variants']
+                if self.index != None:
+                    self.index.add(file_index, attributes, phash=phash)
+            except duplicates.DuplicateItem as duplicate:
+                error = duplicate
+            except Exception as exception:
+                error = exception
+                print('Error: saving %s failed (%s)' % (file_index, exception))
+            elapsed = time.perf_counter() - start
+            if error == None:
+                self.saved += 1
+                self.last_encode_seconds = elapsed
+                self.total_encode_seconds += elapsed
+            elif not isinstance(error, duplicates.DuplicateItem):
+                self.failed += 1
+            self.done.put((on_done, file_index, records, error))
+            self.jobs.task_done()
+
+    def poll(self):
+        """Run completion callbacks of finished items on calling thread"""
+        while not self.done.empty():
+            on_done, file_index, records, error = self.done.get()
+            if on_done != None:
+                on_done(file_index, records, error)
+
+    def wait(self):
+        """Block until all queued items are written"""
+        self.jobs.join()
+        self.poll()
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.depth(),
+            'saved': self.saved,
+            'failed': self.failed,
+            'last_encode_seconds': self.last_encode_seconds,
+            'average_encode_seconds': self.total_encode_seconds / self.saved if self.saved > 0 else 0.0,
+        }